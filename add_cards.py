@@ -1,28 +1,66 @@
+import itertools
+import os
+from contextlib import ExitStack
+
 from anki_helpers import (
-    deck_is_available,
-    create_deck,
-    model_is_available,
-    add_model,
+    ensure_deck,
+    ensure_model,
     add_note,
+    BatchWriter,
+    DEFAULT_BATCH_SIZE,
+    get_existing_words,
+    configure_schema_cache,
+)
+from stats import STATS
+from page_cache import PageCache, DEFAULT_CACHE_PATH
+from journal import Journal, ADDED, DUPLICATE, NOT_FOUND, FAILED
+from pipeline import run_pipeline
+from apkg_writer import ApkgWriter
+from lexicon import Lexicon, StoredNote, DEFAULT_LEXICON_PATH
+from parse_pool import ParsePool, DEFAULT_CHUNK_SIZE
+from scraper_lxml import (
+    generate_note,
+    fetch_mwb_page,
+    configure_cache,
+    configure_fetch_client,
+    configure_prefetcher,
+    DEFAULT_MAX_WASTED_PREFETCHES,
+    configure_lexicon,
+    lookup_note,
+    store_note,
+    DEFAULT_REQUESTS_PER_SECOND,
 )
-from scraper_lxml import generate_default_note, generate_simple_note
+from utils import PageNotCachedException, normalize_word
+
+
+DEFAULT_JOURNAL_PATH = os.path.join(
+    os.path.dirname(DEFAULT_CACHE_PATH), "add_cards.journal"
+)
+DEFAULT_SCHEMA_PATH = os.path.join(os.path.dirname(DEFAULT_CACHE_PATH), "schema.json")
 
 
 class AnkiDutchDeck:
-    def __init__(self, deck_name=None):
+    def __init__(self, deck_name=None, package=None):
         if deck_name is None:
             deck_name = "tidbits"
-        if not deck_is_available(deck_name):
-            create_deck(deck_name)
         self.deck_name = deck_name
+        self.package = package
+        self.journal = None
+        self.existing_words = None
 
         self.default_model_name = "dutch_default"
         self.simple_model_name = "dutch_simple"
 
-        if not model_is_available(self.default_model_name):
+        if package is not None:
+            # everything goes into the .apkg file, anki isn't needed
+            package.add_deck(deck_name)
             self.add_model_default()
-        if not model_is_available(self.simple_model_name):
             self.add_model_simple()
+            return
+
+        ensure_deck(deck_name)
+        self.add_model_default()
+        self.add_model_simple()
 
     def add_model_default(self):
         model_name = "dutch_default"
@@ -42,7 +80,7 @@ class AnkiDutchDeck:
                 "Back": "{{Dutch}}<hr>{{Misc}}<hr><hr>{{Explanations}}",
             },
         ]
-        add_model(model_name, note_fields, card_templates)
+        self.create_model(model_name, note_fields, card_templates)
 
     def add_model_simple(self):
         model_name = "dutch_simple"
@@ -51,7 +89,13 @@ class AnkiDutchDeck:
             {"Front": "{{Dutch}}", "Back": "{{Explanations}}"},
             {"Front": "{{Explanations}}", "Back": "{{Dutch}}"},
         ]
-        add_model(model_name, note_fields, card_templates)
+        self.create_model(model_name, note_fields, card_templates)
+
+    def create_model(self, model_name, note_fields, card_templates):
+        if self.package is not None:
+            self.package.add_model(model_name, note_fields, card_templates)
+        else:
+            ensure_model(model_name, note_fields, card_templates)
 
     def add_note_default(self, note_fields):
         add_note(note_fields, self.deck_name, self.default_model_name)
@@ -59,20 +103,79 @@ class AnkiDutchDeck:
     def add_note_simple(self, note_fields):
         add_note(note_fields, self.deck_name, self.simple_model_name)
 
-    def add_note_from_word(self, word, output_file=None):
-        is_default_model = True
+    def fetch_page(self, word):
+        # notes generated before are served from the lexicon without a fetch
+        stored = lookup_note(word)
+        if stored is not None:
+            return word, stored
         try:
-            note_fields = generate_default_note(word)
-            if note_fields is None:
-                print(f'"{word}" not found in mijnwoordenbook')
-                if output_file:
-                    with open(output_file, "a") as f:
-                        f.write("\n")
-                        f.write(word)
-                return
-        except:
-            is_default_model = False
-            note_fields = generate_simple_note(word)
+            return word, fetch_mwb_page(word)
+        except PageNotCachedException:
+            # offline run, treat the word as not found so it ends up in the output
+            return word, None
+        except Exception as e:
+            # the page couldn't be fetched, the parse stage reports it
+            return word, e
+
+    def parse_page(self, fetched):
+        word, page = fetched
+        if page is None:
+            return word, None, True
+        if isinstance(page, StoredNote):
+            return word, page.fields, page.is_default_model
+        if isinstance(page, Exception):
+            print(f'failed to fetch the page for "{word}": {page}')
+            return word, None, None
+        try:
+            note_fields, is_default_model = generate_note(word, page)
+        except Exception as e:
+            print(f'failed to generate a note for "{word}": {e}')
+            return word, None, None
+        store_note(word, note_fields, is_default_model)
+        return word, note_fields, is_default_model
+
+    def parse_pages(self, pages, parse_pool):
+        for word, parsed in parse_pool.map(pages):
+            if parsed is None:
+                yield word, None, True
+                continue
+            if isinstance(parsed, Exception):
+                print(f'failed to fetch the page for "{word}": {parsed}')
+                yield word, None, None
+                continue
+            note_fields, is_default_model = parsed
+            if not isinstance(parsed, StoredNote):
+                store_note(word, note_fields, is_default_model)
+            yield word, note_fields, is_default_model
+
+    def generate_note(self, word):
+        _, note_fields, is_default_model = self.parse_page(self.fetch_page(word))
+        return note_fields, is_default_model
+
+    def write_note(
+        self, word, note_fields, is_default_model, output_file=None, writer=None
+    ):
+        if is_default_model is None:
+            self.record(word, FAILED)
+            return
+
+        if is_default_model and note_fields is None:
+            print(f'"{word}" not found in mijnwoordenbook')
+            self.record(word, NOT_FOUND)
+            if output_file:
+                with open(output_file, "a") as f:
+                    f.write("\n")
+                    f.write(word)
+            return
+
+        if writer is None:
+            writer = self.package
+        if writer is not None:
+            model_name = (
+                self.default_model_name if is_default_model else self.simple_model_name
+            )
+            writer.add_note(note_fields, self.deck_name, model_name, key=word)
+            return
 
         try:
             if is_default_model:
@@ -82,28 +185,235 @@ class AnkiDutchDeck:
         except:
             print(f'"{word}" already exists in deck {self.deck_name}')
 
-    def add_note_from_list(self, word_list, output_file=None):
-        [self.add_note_from_word(w, output_file) for w in word_list]
+    def add_note_from_word(self, word, output_file=None):
+        note_fields, is_default_model = self.generate_note(word)
+        self.write_note(word, note_fields, is_default_model, output_file)
+
+    def is_handled(self, word):
+        if self.journal is not None and self.journal.is_completed(word):
+            return True
+
+        # known words are dropped before anything is fetched
+        if self.existing_words is not None:
+            if normalize_word(word).casefold() in self.existing_words:
+                print(f'"{word}" already exists in deck {self.deck_name}')
+                self.record(word, DUPLICATE)
+                return True
+        return False
+
+    def record(self, word, status):
+        if self.journal is not None:
+            self.journal.record(word, status)
+
+    def report_write_result(self, word, note_id, error):
+        if error is None:
+            self.record(word, ADDED)
+        elif "duplicate" in str(error):
+            print(f'"{word}" already exists in deck {self.deck_name}')
+            self.record(word, DUPLICATE)
+        else:
+            print(f'failed to add "{word}" to deck {self.deck_name}: {error}')
+            self.record(word, FAILED)
+
+    def add_note_from_list(
+        self,
+        word_list,
+        output_file=None,
+        workers=1,
+        batch_size=DEFAULT_BATCH_SIZE,
+        journal=None,
+        preflight=True,
+        parse_pool=None,
+    ):
+        self.journal = journal
+        if preflight and self.package is None:
+            self.existing_words = get_existing_words(self.deck_name)
+
+        # fetching and parsing run in background stages, writing to anki stays
+        # in this thread and follows the order of word_list
+        parse_map = None
+        if parse_pool is not None:
+            parse_map = lambda pages: self.parse_pages(pages, parse_pool)
+        notes = run_pipeline(
+            word_list,
+            self.fetch_page,
+            self.parse_page,
+            workers,
+            skip=self.is_handled,
+            parse_map=parse_map,
+        )
+        writer = self.package
+        if writer is None:
+            writer = BatchWriter(batch_size)
+        writer.on_result = self.report_write_result
+        try:
+            with writer:
+                for w, note_fields, is_default_model in notes:
+                    self.write_note(
+                        w, note_fields, is_default_model, output_file, writer
+                    )
+        finally:
+            self.journal = None
+            self.existing_words = None
 
 
 if __name__ == "__main__":
     import argparse
+    import sys
 
     parser = argparse.ArgumentParser(description="file containing word list")
-    parser.add_argument("-f", "--file", help="select file containing word list")
+    parser.add_argument(
+        "-f", "--file", help="select file containing word list, - for stdin"
+    )
     parser.add_argument("-l", "--list", help="input word list, separated by comma")
     parser.add_argument("-o", "--output", help="output unfound words to file")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of words fetched and parsed in parallel",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="number of notes sent to anki per request",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=0,
+        help="number of processes parsing pages, 0 parses in this process",
+    )
+    parser.add_argument(
+        "--parse-chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="number of pages sent to a parse process at once",
+    )
+    parser.add_argument(
+        "--cache", default=DEFAULT_CACHE_PATH, help="file to cache scraped pages in"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="always fetch pages from the web"
+    )
+    parser.add_argument(
+        "--offline", action="store_true", help="only use pages from the cache"
+    )
+    parser.add_argument(
+        "--journal",
+        default=DEFAULT_JOURNAL_PATH,
+        help="file recording the outcome of every word",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip words that were already handled according to the journal",
+    )
+    parser.add_argument(
+        "--lexicon",
+        nargs="?",
+        const=DEFAULT_LEXICON_PATH,
+        help="look up words in a local store of generated notes before scraping",
+    )
+    parser.add_argument(
+        "--lexicon-forms",
+        action="store_true",
+        help="also match inflected forms like plurals in the lexicon",
+    )
+    parser.add_argument(
+        "--export", help="write the notes to this .apkg file instead of anki"
+    )
+    parser.add_argument(
+        "--schema-cache",
+        nargs="?",
+        const=DEFAULT_SCHEMA_PATH,
+        help="keep the deck and model names in a file between runs",
+    )
+    parser.add_argument(
+        "--no-preflight",
+        action="store_true",
+        help="don't look up the words already in the deck before scraping",
+    )
+    parser.add_argument(
+        "--stats", action="store_true", help="print timings and counters at the end"
+    )
+    parser.add_argument("--trace", help="write every timing to a json lines file")
+    parser.add_argument(
+        "--prefetch-budget",
+        type=int,
+        default=DEFAULT_MAX_WASTED_PREFETCHES,
+        help="how many unused example page prefetches to allow, 0 disables them",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=DEFAULT_REQUESTS_PER_SECOND,
+        help="maximum number of requests per second to mijnwoordenboek",
+    )
     args = parser.parse_args()
+    if args.offline and args.no_cache:
+        parser.error("--offline needs the page cache, drop --no-cache")
 
-    word_list = []
-    if args.file is not None:
-        words = open(args.file).readlines()
-        word_list.extend(words)
-    if args.list is not None:
-        words = args.list.strip().split(",")
-        word_list.extend(words)
+    if args.stats or args.trace:
+        STATS.enable(args.trace)
 
-    word_list = [w.rstrip() for w in word_list if w.rstrip() != ""]
+    if not args.no_cache:
+        configure_cache(PageCache(args.cache), args.offline)
+    configure_fetch_client(requests_per_second=args.rate)
+    # pages parsed in the pool never use what this process prefetched
+    prefetch_budget = 0 if args.parse_workers > 0 else args.prefetch_budget
+    configure_prefetcher(max_wasted=prefetch_budget)
+    if args.lexicon is not None:
+        configure_lexicon(Lexicon(args.lexicon), args.lexicon_forms)
+    if args.schema_cache is not None:
+        configure_schema_cache(args.schema_cache)
     # word_list = ['hhhsss', 'duits', 'alsjeblieft', 'waterpokken']
-    ADD = AnkiDutchDeck()
-    ADD.add_note_from_list(word_list, args.output)
+    parse_pool = None
+    if args.parse_workers > 0:
+        parse_pool = ParsePool(
+            args.parse_workers,
+            args.parse_chunk_size,
+            None if args.no_cache else args.cache,
+            args.offline,
+            args.rate,
+        )
+    package = None
+    if args.export is not None:
+        package = ApkgWriter(args.export, args.batch_size)
+    # the word file stays open until the run is over
+    files = ExitStack()
+    try:
+        # words are read lazily, "-f -" reads them from stdin
+        word_sources = []
+        if args.file is not None:
+            if args.file == "-":
+                word_sources.append(sys.stdin)
+            else:
+                word_sources.append(files.enter_context(open(args.file)))
+        if args.list is not None:
+            word_sources.append(args.list.strip().split(","))
+        word_list = itertools.chain.from_iterable(word_sources)
+
+        ADD = AnkiDutchDeck(package=package)
+        with Journal(args.journal, args.resume, ADD.deck_name) as word_journal:
+            ADD.add_note_from_list(
+                word_list,
+                args.output,
+                args.workers,
+                args.batch_size,
+                word_journal,
+                not args.no_preflight,
+                parse_pool,
+            )
+    finally:
+        files.close()
+        if package is not None:
+            package.close()
+        if parse_pool is not None:
+            parse_pool.close()
+        if args.stats:
+            print(STATS.summary())
+        STATS.close()
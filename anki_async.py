@@ -0,0 +1,277 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from anki_helpers import (
+    ANKICONN_HOST,
+    DEFAULT_BATCH_SIZE,
+    AnkiConnectClient,
+    find_indexed_note,
+    generate_ankiconnect_action,
+    generate_note_content,
+    get_model_definition,
+    get_schema_cache,
+    index_added_note,
+    is_missing_schema_error,
+    missing_note_error,
+    pick_note_by_word,
+    register_model,
+)
+
+
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_LINGER = 0.002
+
+
+class AsyncAnkiConnect:
+    def __init__(
+        self,
+        url=ANKICONN_HOST,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        batch_size=DEFAULT_BATCH_SIZE,
+        linger=DEFAULT_LINGER,
+    ):
+        self.url = url
+        self.client = AnkiConnectClient(url, maxsize=max_in_flight)
+        self.max_in_flight = max(1, max_in_flight)
+        self.batch_size = max(1, batch_size)
+        self.linger = linger
+        # the blocking urllib3 pool does the io, at most max_in_flight
+        # requests are on the wire at once
+        self.executor = ThreadPoolExecutor(self.max_in_flight)
+        self.semaphore = None
+        self.schema_lock = None
+        self.pending = []
+        self.flush_handle = None
+        # the loop only keeps weak references to tasks
+        self.sending = set()
+
+    async def invoke(self, action, **params):
+        loop = asyncio.get_running_loop()
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        future = loop.create_future()
+        self.pending.append((generate_ankiconnect_action(action, **params), future))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            # calls made within the linger window end up in the same multi
+            self.flush_handle = loop.call_later(self.linger, self.flush)
+        return await future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        while self.pending:
+            batch = self.pending[: self.batch_size]
+            self.pending = self.pending[self.batch_size :]
+            task = asyncio.ensure_future(self.send(batch))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    async def drain(self):
+        # sends what is pending and waits until every request was answered
+        self.flush()
+        while self.sending:
+            await asyncio.gather(*self.sending, return_exceptions=True)
+
+    async def send(self, batch):
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            try:
+                if len(batch) == 1:
+                    action, _ = batch[0]
+                    result = await loop.run_in_executor(
+                        self.executor,
+                        lambda: self.client.invoke(
+                            action["action"], **action["params"]
+                        ),
+                    )
+                    results = [(result, None)]
+                else:
+                    actions = [action for action, _ in batch]
+                    results = await loop.run_in_executor(
+                        self.executor,
+                        lambda: self.client.invoke("multi", actions=actions),
+                    )
+                    results = [(r["result"], r["error"]) for r in results]
+                    if len(results) != len(batch):
+                        raise Exception(
+                            "multi response has an unexpected number of results"
+                        )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+        for (_, future), (result, error) in zip(batch, results):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(Exception(error))
+            else:
+                future.set_result(result)
+
+    async def schema_names(self, kind):
+        # the same cache as the blocking helpers, it only asks anki when the
+        # names are not known yet
+        loop = asyncio.get_running_loop()
+        schema_cache = get_schema_cache(self.url)
+        return await loop.run_in_executor(self.executor, schema_cache.get, kind)
+
+    async def deck_is_available(self, deck_name):
+        return deck_name in await self.schema_names("decks")
+
+    async def create_deck(self, deck_name):
+        result = await self.invoke("createDeck", deck=deck_name)
+        get_schema_cache(self.url).invalidate()
+        return result
+
+    async def model_is_available(self, model_name):
+        return model_name in await self.schema_names("models")
+
+    async def add_model(self, model_name, note_fields, card_templates):
+        result = await self.invoke(
+            "createModel",
+            modelName=model_name,
+            inOrderFields=note_fields,
+            cardTemplates=card_templates,
+        )
+        get_schema_cache(self.url).invalidate()
+        return result
+
+    async def ensure_deck(self, deck_name):
+        if not await self.deck_is_available(deck_name):
+            await self.create_deck(deck_name)
+
+    async def ensure_model(self, model_name, note_fields, card_templates):
+        register_model(model_name, note_fields, card_templates)
+        if not await self.model_is_available(model_name):
+            await self.add_model(model_name, note_fields, card_templates)
+
+    async def restore_schema(self, notes):
+        # see anki_helpers.restore_schema. notes failing together restore one
+        # at a time, the later ones find the deck and model already there
+        if self.schema_lock is None:
+            self.schema_lock = asyncio.Lock()
+        async with self.schema_lock:
+            get_schema_cache(self.url).invalidate()
+            for deck_name in sorted({note["deckName"] for note in notes}):
+                await self.ensure_deck(deck_name)
+            for model_name in sorted({note["modelName"] for note in notes}):
+                definition = get_model_definition(model_name)
+                if definition is not None:
+                    await self.ensure_model(model_name, *definition)
+
+    async def add_note(self, note_fields, deck_name, model_name):
+        note_content = generate_note_content(note_fields, deck_name, model_name)
+        try:
+            result = await self.invoke("addNote", note=note_content)
+        except Exception as e:
+            if not is_missing_schema_error(e):
+                raise
+            await self.restore_schema([note_content])
+            result = await self.invoke("addNote", note=note_content)
+        index_added_note(note_content, result)
+        return result
+
+    async def find_all_notes_in_deck(self, deck_name):
+        return await self.invoke("findNotes", query=f"deck:{deck_name}")
+
+    async def get_note_by_id(self, note_id):
+        results = await self.invoke("notesInfo", notes=[note_id])
+        return results[0]
+
+    async def find_note_by_word(self, word, deck_name):
+        note_id = find_indexed_note(word, deck_name)
+        if note_id is not None:
+            return note_id
+
+        results = await self.invoke("findNotes", query=f"deck:{deck_name} {word}")
+        if not results:
+            return
+
+        notes = await self.invoke("notesInfo", notes=results)
+        return pick_note_by_word(word, notes)
+
+    async def update_note(self, note_fields, deck_name, model_name, note_id=None):
+        if note_id is None:
+            note_id = await self.find_note_by_word(note_fields["Dutch"], deck_name)
+        if note_id is None:
+            raise missing_note_error(note_fields["Dutch"], deck_name)
+        return await self.invoke(
+            "updateNoteFields", note={"id": note_id, "fields": note_fields}
+        )
+
+    def close(self):
+        self.executor.shutdown()
+        self.client.close()
+
+
+class SyncAnkiConnect:
+    # runs the async client on a background loop, so plain functions and
+    # worker threads can share its batching
+    def __init__(self, url=ANKICONN_HOST, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = AsyncAnkiConnect(url, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def invoke(self, action, **params):
+        return self.run(self.client.invoke(action, **params))
+
+    def deck_is_available(self, deck_name):
+        return self.run(self.client.deck_is_available(deck_name))
+
+    def create_deck(self, deck_name):
+        return self.run(self.client.create_deck(deck_name))
+
+    def model_is_available(self, model_name):
+        return self.run(self.client.model_is_available(model_name))
+
+    def add_model(self, model_name, note_fields, card_templates):
+        return self.run(self.client.add_model(model_name, note_fields, card_templates))
+
+    def ensure_deck(self, deck_name):
+        return self.run(self.client.ensure_deck(deck_name))
+
+    def ensure_model(self, model_name, note_fields, card_templates):
+        return self.run(
+            self.client.ensure_model(model_name, note_fields, card_templates)
+        )
+
+    def add_note(self, note_fields, deck_name, model_name):
+        return self.run(self.client.add_note(note_fields, deck_name, model_name))
+
+    def find_all_notes_in_deck(self, deck_name):
+        return self.run(self.client.find_all_notes_in_deck(deck_name))
+
+    def get_note_by_id(self, note_id):
+        return self.run(self.client.get_note_by_id(note_id))
+
+    def find_note_by_word(self, word, deck_name):
+        return self.run(self.client.find_note_by_word(word, deck_name))
+
+    def update_note(self, note_fields, deck_name, model_name, note_id=None):
+        return self.run(
+            self.client.update_note(note_fields, deck_name, model_name, note_id)
+        )
+
+    def close(self):
+        self.run(self.client.drain())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.client.close()
+        self.loop.close()
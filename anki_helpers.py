@@ -1,38 +1,121 @@
 import json
-from urllib.request import urlopen, Request
-from urllib.parse import quote, urlencode
-from difflib import SequenceMatcher
+import os
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import urllib3
+
+from stats import STATS
+from utils import bounded_edit_distance, deletion_variants, normalize_word
 
 
 ANKICONN_VERSION = 6
 ANKICONN_HOST = "http://localhost:8765"
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_NOTES_INFO_SIZE = 500
+MAX_WORD_DISTANCE = 2
+DEFAULT_SCHEMA_TTL = 24 * 60 * 60
+MISSING_SCHEMA_ERRORS = ("deck was not found", "model was not found")
+
+
+def generate_ankiconnect_action(action, **params):
+    # also used for the actions inside a multi, without the version anki
+    # answers those with the bare result and drops the error
+    return {"action": action, "params": params, "version": ANKICONN_VERSION}
 
 
 def generate_ankiconnect_json_request(action, **params):
-    request_dict = {"action": action, "params": params, "version": ANKICONN_VERSION}
+    request_dict = generate_ankiconnect_action(action, **params)
     request_json = json.dumps(request_dict)
     return request_json
 
 
-def invoke(action, url=None, **params):
+class AnkiConnectClient:
+    def __init__(
+        self,
+        url=ANKICONN_HOST,
+        connect_timeout=2.0,
+        read_timeout=60.0,
+        retries=3,
+        backoff_factor=0.2,
+        maxsize=4,
+    ):
+        parsed_url = urlparse(url)
+        self.url = url
+        self.path = parsed_url.path or "/"
+        # only connection failures are retried, a request that reached anki
+        # might have been applied already
+        retry = urllib3.Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=backoff_factor,
+            allowed_methods=None,
+        )
+        self.pool = urllib3.HTTPConnectionPool(
+            parsed_url.hostname,
+            parsed_url.port,
+            maxsize=maxsize,
+            timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+            retries=retry,
+            headers={"Content-Type": "application/json"},
+        )
+        self._encoded_requests = {}
+
+    def encode_request(self, action, **params):
+        if params:
+            return str.encode(generate_ankiconnect_json_request(action, **params))
+
+        # requests without parameters are the same every time
+        if action not in self._encoded_requests:
+            self._encoded_requests[action] = str.encode(
+                generate_ankiconnect_json_request(action)
+            )
+        return self._encoded_requests[action]
+
+    def invoke(self, action, **params):
+        request_json = self.encode_request(action, **params)
+        with STATS.timer(f"anki {action}"):
+            u = self.pool.urlopen("POST", self.path, body=request_json)
+        response = json.loads(u.data)
+
+        if len(response) != 2:
+            raise Exception("response has an unexpected number of fields")
+        if "error" not in response:
+            raise Exception("response is missing required error field")
+        if "result" not in response:
+            raise Exception("response is missing required result field")
+        if response["error"] is not None:
+            raise Exception(response["error"])
+        return response["result"]
+
+    def close(self):
+        self.pool.close()
+
+
+_clients = {}
+
+
+def get_client(url=None):
     if url is None:
         url = ANKICONN_HOST
+    if url not in _clients:
+        _clients[url] = AnkiConnectClient(url)
+    return _clients[url]
+
 
-    request_json = generate_ankiconnect_json_request(action, **params)
-    request_json = str.encode(request_json)
+def configure_client(url=ANKICONN_HOST, **kwargs):
+    if url in _clients:
+        _clients[url].close()
+    _clients[url] = AnkiConnectClient(url, **kwargs)
+    return _clients[url]
 
-    with urlopen(Request(url, request_json)) as u:
-        response = json.load(u)
 
-    if len(response) != 2:
-        raise Exception("response has an unexpected number of fields")
-    if "error" not in response:
-        raise Exception("response is missing required error field")
-    if "result" not in response:
-        raise Exception("response is missing required result field")
-    if response["error"] is not None:
-        raise Exception(response["error"])
-    return response["result"]
+def invoke(action, url=None, **params):
+    return get_client(url).invoke(action, **params)
 
 
 def check_version():
@@ -42,13 +125,96 @@ def check_version():
     )
 
 
+class SchemaCache:
+    # deck and model names, fetched together once per process. with a path
+    # they are also kept between runs and trusted while the file is younger
+    # than ttl. anki can't tell cheaply whether they changed, so notes that
+    # fail on a missing deck or model invalidate them (see restore_schema)
+    def __init__(self, url=None, path=None, ttl=DEFAULT_SCHEMA_TTL):
+        self.url = url
+        self.path = path
+        self.ttl = ttl
+        self.names = None
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except ValueError:
+            return None
+        if time.time() - saved["saved_at"] > self.ttl:
+            return None
+        if saved["url"] != (self.url or ANKICONN_HOST):
+            return None
+        return {"decks": set(saved["decks"]), "models": set(saved["models"])}
+
+    def save(self):
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        saved = dict(
+            url=self.url or ANKICONN_HOST,
+            saved_at=time.time(),
+            decks=sorted(self.names["decks"]),
+            models=sorted(self.names["models"]),
+        )
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(saved, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def fetch(self):
+        actions = [
+            generate_ankiconnect_action("deckNames"),
+            generate_ankiconnect_action("modelNames"),
+        ]
+        (decks, deck_error), (models, model_error) = invoke_multi(actions, self.url)
+        if deck_error is not None or model_error is not None:
+            raise Exception(deck_error or model_error)
+        return {"decks": set(decks), "models": set(models)}
+
+    def get(self, kind):
+        if self.names is None:
+            self.names = self.load()
+        if self.names is None:
+            self.names = self.fetch()
+            self.save()
+        return self.names[kind]
+
+    def invalidate(self):
+        self.names = None
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+_schema_caches = {}
+
+
+def get_schema_cache(url=None):
+    if url is None:
+        url = ANKICONN_HOST
+    if url not in _schema_caches:
+        _schema_caches[url] = SchemaCache(url)
+    return _schema_caches[url]
+
+
+def configure_schema_cache(path=None, url=None, **kwargs):
+    if url is None:
+        url = ANKICONN_HOST
+    _schema_caches[url] = SchemaCache(url, path, **kwargs)
+    return _schema_caches[url]
+
+
 def deck_is_available(deck_name):
-    result = invoke("deckNames")
-    return deck_name in result
+    return deck_name in get_schema_cache().get("decks")
 
 
 def create_deck(deck_name, verbose=False):
     result = invoke("createDeck", deck=deck_name)
+    get_schema_cache().invalidate()
 
     if verbose:
         deck_names = invoke("deckNames")
@@ -59,8 +225,7 @@ def create_deck(deck_name, verbose=False):
 
 
 def model_is_available(model_name):
-    result = invoke("modelNames")
-    return model_name in result
+    return model_name in get_schema_cache().get("models")
 
 
 def add_model(model_name, note_fields, card_templates):
@@ -70,10 +235,58 @@ def add_model(model_name, note_fields, card_templates):
         inOrderFields=note_fields,
         cardTemplates=card_templates,
     )
+    get_schema_cache().invalidate()
     return result
 
 
-def add_note(note_fields, deck_name, model_name):
+def ensure_deck(deck_name):
+    if not deck_is_available(deck_name):
+        create_deck(deck_name)
+
+
+_model_definitions = {}
+
+
+def register_model(model_name, note_fields, card_templates):
+    # the definition is kept, so the model can be created again when it turns
+    # out to be missing after all
+    _model_definitions[model_name] = (note_fields, card_templates)
+
+
+def get_model_definition(model_name):
+    return _model_definitions.get(model_name)
+
+
+def ensure_model(model_name, note_fields, card_templates):
+    register_model(model_name, note_fields, card_templates)
+    if not model_is_available(model_name):
+        add_model(model_name, note_fields, card_templates)
+
+
+def is_missing_schema_error(error):
+    return error is not None and any(e in str(error) for e in MISSING_SCHEMA_ERRORS)
+
+
+def restore_schema(notes):
+    # the cached names were stale, anki switched profiles or a deck or model
+    # was removed. look them up again and create what is missing
+    get_schema_cache().invalidate()
+    for deck_name in sorted({note["deckName"] for note in notes}):
+        ensure_deck(deck_name)
+    for model_name in sorted({note["modelName"] for note in notes}):
+        definition = get_model_definition(model_name)
+        if definition is not None:
+            ensure_model(model_name, *definition)
+
+
+def invoke_multi(actions, url=None):
+    # the actions carry the version, so every one is answered with its own
+    # result and error
+    results = invoke("multi", url=url, actions=actions)
+    return [(r["result"], r["error"]) for r in results]
+
+
+def generate_note_content(note_fields, deck_name, model_name):
     note_content = dict(
         deckName=deck_name,
         modelName=model_name,
@@ -81,7 +294,79 @@ def add_note(note_fields, deck_name, model_name):
         options=dict(allowDuplicate=False),
         tags=["dutch"],
     )
-    result = invoke("addNote", note=note_content)
+    return note_content
+
+
+def add_note(note_fields, deck_name, model_name):
+    note_content = generate_note_content(note_fields, deck_name, model_name)
+    try:
+        result = invoke("addNote", note=note_content)
+    except Exception as e:
+        if not is_missing_schema_error(e):
+            raise
+        restore_schema([note_content])
+        result = invoke("addNote", note=note_content)
+    index_added_note(note_content, result)
+    return result
+
+
+class BatchWriter:
+    def __init__(self, chunk_size=DEFAULT_BATCH_SIZE, on_result=None):
+        self.chunk_size = max(1, chunk_size)
+        self.on_result = on_result
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add_action(self, key, action, **params):
+        self.pending.append((key, generate_ankiconnect_action(action, **params)))
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def add_note(self, note_fields, deck_name, model_name, key=None):
+        note_content = generate_note_content(note_fields, deck_name, model_name)
+        self.add_action(key, "addNote", note=note_content)
+
+    def update_note(self, note_fields, note_id, key=None):
+        self.add_action(
+            key, "updateNoteFields", note={"id": note_id, "fields": note_fields}
+        )
+
+    def flush(self):
+        if not self.pending:
+            return []
+
+        pending, self.pending = self.pending, []
+        results = invoke_multi([action for _, action in pending])
+        if len(results) != len(pending):
+            raise Exception("multi response has an unexpected number of results")
+
+        # notes that failed on a deck or model missing from a stale schema
+        # cache are sent once more, after creating what is missing
+        retry = [
+            i
+            for i, ((_, action), (_, error)) in enumerate(zip(pending, results))
+            if action["action"] == "addNote" and is_missing_schema_error(error)
+        ]
+        if retry:
+            restore_schema([pending[i][1]["params"]["note"] for i in retry])
+            retried = invoke_multi([pending[i][1] for i in retry])
+            for i, result in zip(retry, retried):
+                results[i] = result
+
+        for (_, action), (result, error) in zip(pending, results):
+            if action["action"] == "addNote" and error is None:
+                index_added_note(action["params"]["note"], result)
+
+        results = [(key, r, e) for (key, _), (r, e) in zip(pending, results)]
+        if self.on_result is not None:
+            for key, result, error in results:
+                self.on_result(key, result, error)
+        return results
 
 
 def get_note_by_id(note_id):
@@ -89,36 +374,149 @@ def get_note_by_id(note_id):
     return results[0]
 
 
+def get_notes_by_ids(note_ids, chunk_size=DEFAULT_NOTES_INFO_SIZE):
+    note_ids = list(note_ids)
+    for i in range(0, len(note_ids), chunk_size):
+        results = invoke("notesInfo", notes=note_ids[i : i + chunk_size])
+        yield from results
+
+
 def find_all_notes_in_deck(deck_name):
     results = invoke("findNotes", query=f"deck:{deck_name}")
     return results
 
 
+def get_existing_words(deck_name):
+    # every headword in the deck, the way add_cards.py would look it up. the
+    # index is kept so notes can be found by word for the rest of the run
+    index = WordIndex.build(deck_name)
+    _word_indexes[deck_name] = index
+    return set(index.ids_by_word)
+
+
+def normalize_note_word(word):
+    return normalize_word(word).casefold()
+
+
+def note_words(dutch_field):
+    return {normalize_note_word(word) for word in dutch_field.split(";")} - {""}
+
+
+def rank_by_distance(word, candidates):
+    # candidates are (note_id, normalized word) pairs, closest first
+    word = normalize_note_word(word)
+    distances = [
+        (
+            bounded_edit_distance(word, name, max(len(word), len(name))),
+            abs(len(word) - len(name)),
+        )
+        for _, name in candidates
+    ]
+    order = sorted(range(len(candidates)), key=lambda i: distances[i])
+    return [candidates[i][0] for i in order]
+
+
+class WordIndex:
+    def __init__(self, deck_name, max_distance=MAX_WORD_DISTANCE):
+        self.deck_name = deck_name
+        self.max_distance = max_distance
+        self.ids_by_word = defaultdict(list)
+        self.words_by_variant = defaultdict(set)
+
+    @classmethod
+    def build(cls, deck_name, **kwargs):
+        index = cls(deck_name, **kwargs)
+        note_ids = find_all_notes_in_deck(deck_name)
+        for note in get_notes_by_ids(note_ids):
+            index.add(note["noteId"], note["fields"]["Dutch"]["value"])
+        return index
+
+    def add(self, note_id, dutch_field):
+        for word in note_words(dutch_field):
+            if note_id in self.ids_by_word[word]:
+                continue
+            self.ids_by_word[word].append(note_id)
+            # words one edit apart share a deletion variant
+            for variant in deletion_variants(word) | {word}:
+                self.words_by_variant[variant].add(word)
+
+    def lookup(self, word):
+        # only the note with exactly this word, a close word is another note
+        ids = self.ids_by_word.get(normalize_note_word(word))
+        return ids[0] if ids else None
+
+    def similar(self, word, limit=3):
+        word = normalize_note_word(word)
+        candidates = set()
+        for variant in deletion_variants(word) | {word}:
+            candidates.update(self.words_by_variant.get(variant, ()))
+        candidates = [
+            (c, c)
+            for c in sorted(candidates)
+            if c != word
+            and bounded_edit_distance(word, c, self.max_distance) <= self.max_distance
+        ]
+        return rank_by_distance(word, candidates)[:limit]
+
+
+_word_indexes = {}
+
+
+def get_word_index(deck_name):
+    if deck_name not in _word_indexes:
+        _word_indexes[deck_name] = WordIndex.build(deck_name)
+    return _word_indexes[deck_name]
+
+
+def index_added_note(note_content, note_id):
+    index = _word_indexes.get(note_content["deckName"])
+    if index is not None and note_id is not None:
+        index.add(note_id, note_content["fields"]["Dutch"])
+
+
+def pick_note_by_word(word, notes):
+    # findNotes also matches words in the other fields, only a note with the
+    # word itself in its Dutch field is the one to update
+    word = normalize_note_word(word)
+    for note in notes:
+        if word in note_words(note["fields"]["Dutch"]["value"]):
+            return note["noteId"]
+
+
+def missing_note_error(word, deck_name):
+    message = f'no note for "{word}" in deck {deck_name}'
+    index = _word_indexes.get(deck_name)
+    similar = index.similar(word) if index is not None else []
+    if similar:
+        message += f", did you mean {', '.join(similar)}?"
+    return Exception(message)
+
+
+def find_indexed_note(word, deck_name):
+    # None when the word isn't in the deck's index, or no index was built
+    index = _word_indexes.get(deck_name)
+    return index.lookup(word) if index is not None else None
+
+
 def find_note_by_word(word, deck_name):
+    note_id = find_indexed_note(word, deck_name)
+    if note_id is not None:
+        return note_id
+
     results = invoke("findNotes", query=f"deck:{deck_name} {word}")
 
     if not results:
         return
 
-    if len(results) == 1:
-        return results[0]
-
-    note_names = [
-        get_note_by_id(note_id)["fields"]["Dutch"]["value"] for note_id in results
-    ]
-    similarities = [
-        SequenceMatcher(None, word, note_name).ratio() for note_name in note_names
-    ]
-    results_sorted_by_similarity = sorted(
-        list(zip(results, similarities)), key=lambda x: x[1]
-    )
-    return results_sorted_by_similarity[-1][0]
+    return pick_note_by_word(word, get_notes_by_ids(results))
 
 
 def update_note(note_fields, deck_name, model_name, note_id=None):
 
     if note_id is None:
         note_id = find_note_by_word(note_fields["Dutch"], deck_name)
+    if note_id is None:
+        raise missing_note_error(note_fields["Dutch"], deck_name)
 
     results = invoke("updateNoteFields", note={"id": note_id, "fields": note_fields})
     return results
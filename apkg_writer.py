@@ -0,0 +1,364 @@
+import hashlib
+import html
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import zipfile
+
+from anki_helpers import DEFAULT_BATCH_SIZE
+
+
+SCHEMA_VERSION = 11
+FIELD_SEPARATOR = "\x1f"
+NOTE_TAGS = ["dutch"]
+DUPLICATE_ERROR = "cannot create note because it is a duplicate"
+
+# the same defaults AnkiConnect's createModel uses
+DEFAULT_CSS = """.card {
+ font-family: arial;
+ font-size: 20px;
+ text-align: center;
+ color: black;
+ background-color: white;
+}
+"""
+LATEX_PRE = (
+    "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n"
+    "\\usepackage[utf8]{inputenc}\n\\usepackage{amssymb,amsmath}\n"
+    "\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n"
+)
+LATEX_POST = "\\end{document}"
+
+COLLECTION_SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null,
+    scm integer not null, ver integer not null, dty integer not null,
+    usn integer not null, ls integer not null, conf text not null,
+    models text not null, decks text not null, dconf text not null,
+    tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null,
+    mod integer not null, usn integer not null, tags text not null,
+    flds text not null, sfld integer not null, csum integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null,
+    ord integer not null, mod integer not null, usn integer not null,
+    type integer not null, queue integer not null, due integer not null,
+    ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null,
+    odid integer not null, flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null,
+    ease integer not null, ivl integer not null, lastIvl integer not null,
+    factor integer not null, time integer not null, type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+DEFAULT_DECK_CONF = {
+    "id": 1,
+    "name": "Default",
+    "mod": 0,
+    "usn": 0,
+    "dyn": False,
+    "autoplay": True,
+    "replayq": True,
+    "timer": 0,
+    "maxTaken": 60,
+    "new": {
+        "bury": True,
+        "delays": [1, 10],
+        "initialFactor": 2500,
+        "ints": [1, 4, 7],
+        "order": 1,
+        "perDay": 20,
+        "separate": True,
+    },
+    "lapse": {
+        "delays": [10],
+        "leechAction": 0,
+        "leechFails": 8,
+        "minInt": 1,
+        "mult": 0,
+    },
+    "rev": {
+        "bury": True,
+        "ease4": 1.3,
+        "fuzz": 0.05,
+        "ivlFct": 1,
+        "maxIvl": 36500,
+        "minSpace": 1,
+        "perDay": 100,
+    },
+}
+
+
+def stable_id(name):
+    # the same deck or model gets the same id in every package, so importing
+    # a second package adds to what the first one created
+    return int(hashlib.sha1(name.encode("utf-8")).hexdigest()[:8], 16) + (1 << 40)
+
+
+def strip_html(text):
+    return html.unescape(re.sub(r"<[^>]*>", "", text)).strip()
+
+
+def field_checksum(text):
+    return int(hashlib.sha1(strip_html(text).encode("utf-8")).hexdigest()[:8], 16)
+
+
+def template_fields(template):
+    return re.findall(r"{{([^{}#/^]+)}}", template)
+
+
+def new_deck(deck_id, name, mod):
+    return {
+        "id": deck_id,
+        "name": name,
+        "mod": mod,
+        "usn": -1,
+        "desc": "",
+        "dyn": 0,
+        "conf": 1,
+        "collapsed": False,
+        "browserCollapsed": False,
+        "extendNew": 10,
+        "extendRev": 50,
+        "newToday": [0, 0],
+        "revToday": [0, 0],
+        "lrnToday": [0, 0],
+        "timeToday": [0, 0],
+    }
+
+
+class ApkgWriter:
+    # writes notes into a legacy anki collection and packs it as an .apkg,
+    # takes the same add_note calls as anki_helpers.BatchWriter
+    def __init__(self, path, chunk_size=DEFAULT_BATCH_SIZE, on_result=None):
+        self.path = path
+        self.chunk_size = max(1, chunk_size)
+        self.on_result = on_result
+        self.pending = []
+        self.now = int(time.time())
+        self.next_id = int(time.time() * 1000)
+        self.next_position = 1
+        self.decks = {"1": new_deck(1, "Default", self.now)}
+        self.models = {}
+        self.model_ids = {}
+        self.deck_ids = {}
+        self.checksums = set()
+
+        handle, self.collection_path = tempfile.mkstemp(suffix=".anki2")
+        os.close(handle)
+        self.db = sqlite3.connect(self.collection_path)
+        self.db.executescript(COLLECTION_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # like BatchWriter, leaving the block only flushes, close() writes the
+        # package
+        self.flush()
+
+    def new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def add_deck(self, deck_name):
+        if deck_name not in self.deck_ids:
+            deck_id = stable_id(deck_name)
+            self.deck_ids[deck_name] = deck_id
+            self.decks[str(deck_id)] = new_deck(deck_id, deck_name, self.now)
+        return self.deck_ids[deck_name]
+
+    def add_model(self, model_name, note_fields, card_templates):
+        model_id = stable_id(model_name)
+        templates = [
+            {
+                "name": f"Card {i + 1}",
+                "ord": i,
+                "qfmt": t["Front"],
+                "afmt": t["Back"],
+                "did": None,
+                "bqfmt": "",
+                "bafmt": "",
+            }
+            for i, t in enumerate(card_templates)
+        ]
+        self.model_ids[model_name] = model_id
+        self.models[str(model_id)] = {
+            "id": model_id,
+            "name": model_name,
+            "type": 0,
+            "mod": self.now,
+            "usn": -1,
+            "sortf": 0,
+            "did": 1,
+            "tmpls": templates,
+            "flds": [
+                {
+                    "name": name,
+                    "ord": i,
+                    "sticky": False,
+                    "rtl": False,
+                    "font": "Arial",
+                    "size": 20,
+                    "media": [],
+                }
+                for i, name in enumerate(note_fields)
+            ],
+            "css": DEFAULT_CSS,
+            "latexPre": LATEX_PRE,
+            "latexPost": LATEX_POST,
+            "latexsvg": False,
+            "tags": [],
+            "vers": [],
+            "req": [
+                [
+                    t["ord"],
+                    "any",
+                    [note_fields.index(f) for f in template_fields(t["qfmt"])],
+                ]
+                for t in templates
+            ],
+        }
+        return model_id
+
+    def add_note(self, note_fields, deck_name, model_name, key=None):
+        self.pending.append((key, note_fields, deck_name, model_name))
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def build_rows(self, note_fields, deck_name, model_name):
+        model = self.models[str(self.model_ids[model_name])]
+        fields = [note_fields.get(f["name"], "") for f in model["flds"]]
+        checksum = field_checksum(fields[0])
+        # like anki, a note is a duplicate when its first field is already
+        # used by another note of the same model
+        if (model["id"], checksum, strip_html(fields[0])) in self.checksums:
+            raise Exception(DUPLICATE_ERROR)
+        self.checksums.add((model["id"], checksum, strip_html(fields[0])))
+
+        note_id = self.new_id()
+        guid = hashlib.sha1(f"{model_name}:{fields[0]}".encode("utf-8")).hexdigest()
+        note = (
+            note_id,
+            guid[:10],
+            model["id"],
+            self.now,
+            -1,
+            " " + " ".join(NOTE_TAGS) + " ",
+            FIELD_SEPARATOR.join(fields),
+            strip_html(fields[0]),
+            checksum,
+            0,
+            "",
+        )
+
+        deck_id = self.add_deck(deck_name)
+        cards = []
+        for template, (_, _, required) in zip(model["tmpls"], model["req"]):
+            # a card only exists if its front shows something
+            if not any(fields[i] for i in required):
+                continue
+            cards.append(
+                (self.new_id(), note_id, deck_id, template["ord"], self.now, -1)
+                + (0, 0, self.next_position, 0, 0, 0, 0, 0, 0, 0, 0, "")
+            )
+        self.next_position += 1
+        return note, cards
+
+    def flush(self):
+        if not self.pending:
+            return []
+
+        pending, self.pending = self.pending, []
+        notes, cards, results = [], [], []
+        for key, note_fields, deck_name, model_name in pending:
+            try:
+                note, note_cards = self.build_rows(note_fields, deck_name, model_name)
+            except Exception as e:
+                results.append((key, None, str(e)))
+                continue
+            notes.append(note)
+            cards.extend(note_cards)
+            results.append((key, note[0], None))
+
+        # every chunk is one transaction
+        with self.db:
+            self.db.executemany(
+                "insert into notes values (?,?,?,?,?,?,?,?,?,?,?)", notes
+            )
+            self.db.executemany(
+                "insert into cards values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                cards,
+            )
+
+        if self.on_result is not None:
+            for key, result, error in results:
+                self.on_result(key, result, error)
+        return results
+
+    def write_collection(self):
+        conf = {
+            "activeDecks": [1],
+            "curDeck": 1,
+            "newSpread": 0,
+            "collapseTime": 1200,
+            "timeLim": 0,
+            "estTimes": True,
+            "dueCounts": True,
+            "curModel": None,
+            "nextPos": self.next_position,
+            "sortType": "noteFld",
+            "sortBackwards": False,
+            "addToCur": True,
+        }
+        with self.db:
+            self.db.execute(
+                "insert or replace into col values (1,?,?,?,?,0,0,0,?,?,?,?,?)",
+                (
+                    self.now,
+                    self.now * 1000,
+                    self.now * 1000,
+                    SCHEMA_VERSION,
+                    json.dumps(conf),
+                    json.dumps(self.models),
+                    json.dumps(self.decks),
+                    json.dumps({"1": DEFAULT_DECK_CONF}),
+                    json.dumps({}),
+                ),
+            )
+
+    def close(self):
+        if self.db is None:
+            return
+        try:
+            self.flush()
+            self.write_collection()
+            self.db.close()
+            self.db = None
+
+            with zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED) as package:
+                package.write(self.collection_path, "collection.anki2")
+                package.writestr("media", json.dumps({}))
+        finally:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+            os.remove(self.collection_path)
@@ -0,0 +1,321 @@
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import timeit
+from contextlib import contextmanager, redirect_stdout
+
+import anki_helpers
+import extractors
+import scraper_lxml
+from add_cards import AnkiDutchDeck
+from fake_ankiconnect import FakeAnkiConnect
+from page_cache import PageCache, url_key
+from scraper_lxml import MwbPage, get_mwb_url, generate_note, generate_default_note
+from update_notes import update_all_notes_in_deck, RefreshState
+
+
+DEFAULT_PAGES_DIR = "benchmark_pages"
+DEFAULT_WORDS_FILE = "benchmark_words.txt"
+
+# the string queries NoteDefault and NoteExpression evaluated before extractors
+LEGACY_QUERIES = {
+    "main": [
+        '//div/h2[@class="inline"]',
+        '//div/h2[@class="inline"]/parent::*/text()',
+        '//div/h2[@class="inline"]/following-sibling::table[1]/tr',
+        '//div/font[@style="color:navy;font-size:10pt"]',
+        '//div/font[@style="color:navy;font-size:10pt"]/preceding-sibling::font[1]',
+        '//i/font[@style="color:#422526"]',
+        '//i/following-sibling::font[@style="color:navy"]',
+    ],
+    "expression": [
+        '//a[contains(@onclick, "shoh")]/following-sibling::font[1]',
+        '//font[@style="color:darkgreen"]',
+        '//font[@style="color:darkgreen"]/following-sibling::font[@style="color:navy"][1]',
+        '//font[@style="color:darkgreen"]/following-sibling::font[@style="color:#444"]',
+        '//font[@style="color:darkgreen"]/following-sibling::font[@style="color:#444"]/following-sibling::font[@style="color:navy"]',
+    ],
+}
+
+
+def read_index(pages_dir):
+    index_path = os.path.join(pages_dir, "index.json")
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            return json.load(f)
+
+    # a plain directory of pages saved by hand, named after their word
+    return {
+        get_mwb_url(filename[: -len(".html")]): filename
+        for filename in sorted(os.listdir(pages_dir))
+        if filename.endswith(".html")
+    }
+
+
+def read_page(pages_dir, filename):
+    with open(os.path.join(pages_dir, filename), "rb") as f:
+        return f.read()
+
+
+def load_pages(pages_dir=DEFAULT_PAGES_DIR):
+    prefix = get_mwb_url("")
+    return [
+        MwbPage(url[len(prefix) :], read_page(pages_dir, filename))
+        for url, filename in read_index(pages_dir).items()
+        if url.startswith(prefix)
+    ]
+
+
+def load_words(pages_dir=DEFAULT_PAGES_DIR):
+    return [page.word for page in load_pages(pages_dir)]
+
+
+def seed_cache(page_cache, pages_dir=DEFAULT_PAGES_DIR):
+    for url, filename in read_index(pages_dir).items():
+        page_cache.put(url, read_page(pages_dir, filename))
+
+
+def record_pages(words, pages_dir=DEFAULT_PAGES_DIR):
+    # every page a note needs, including the secondary example pages, is
+    # fetched through a scratch cache and then written out
+    os.makedirs(pages_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        page_cache = PageCache(os.path.join(tmp, "pages.sqlite"), ttl=None)
+        scraper_lxml.configure_cache(page_cache)
+        for word in words:
+            try:
+                generate_note(word)
+            except Exception as e:
+                print(f"failed to generate a note for [{word}]: {e}")
+            print(f"recorded [{word}]")
+
+        prefix = get_mwb_url("")
+        index = {}
+        for url, content in page_cache.items():
+            if url.startswith(prefix):
+                filename = f"{url[len(prefix) :]}.html"
+            else:
+                filename = f"extra_{url_key(url)[:16]}.html"
+            with open(os.path.join(pages_dir, filename), "wb") as f:
+                f.write(content)
+            index[url] = filename
+        page_cache.close()
+        scraper_lxml.configure_cache(None)
+
+    with open(os.path.join(pages_dir, "index.json"), "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+
+
+def get_sections(page):
+    return {
+        "main": page.section("NL>EN", "Overige bronnen"),
+        "expression": page.expression_section(),
+    }
+
+
+def run_legacy(sections):
+    for name, queries in LEGACY_QUERIES.items():
+        section = sections[name]
+        for query in queries:
+            [x for x in section.page.doc.xpath(query) if x in section]
+
+
+def run_extractors(sections):
+    extractors.extract_headwords(sections["main"])
+    extractors.extract_explanations(sections["main"])
+    extractors.extract_examples(sections["main"])
+    extractors.extract_expressions(sections["expression"])
+
+
+def benchmark_extractors(pages, number=100):
+    total_legacy = total_extractors = 0
+    for page in pages:
+        sections = get_sections(page)
+        legacy = timeit.timeit(lambda: run_legacy(sections), number=number)
+        compiled = timeit.timeit(lambda: run_extractors(sections), number=number)
+        total_legacy += legacy
+        total_extractors += compiled
+        print(
+            f"{page.word:<30} legacy {legacy / number * 1e3:8.3f}ms"
+            f"  extractors {compiled / number * 1e3:8.3f}ms"
+        )
+    print(
+        f"{'total':<30} legacy {total_legacy / number * 1e3:8.3f}ms"
+        f"  extractors {total_extractors / number * 1e3:8.3f}ms"
+    )
+
+
+class StageTimer:
+    def __init__(self):
+        self.latencies = {}
+
+    def add(self, stage, seconds):
+        self.latencies.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+
+        return timed
+
+
+@contextmanager
+def timed_stages(timer):
+    # wraps the stage functions for the duration of one scenario
+    patched = [
+        (scraper_lxml, "get_mwb_html", "fetch"),
+        (scraper_lxml.NoteDefault, "generate_notes", "extract"),
+        (scraper_lxml, "generate_simple_note", "extract simple"),
+        (anki_helpers.AnkiConnectClient, "invoke", "anki"),
+    ]
+    originals = [(owner, name, getattr(owner, name)) for owner, name, _ in patched]
+    doc = scraper_lxml.MwbPage.doc
+    timed_parse = timer.wrap("parse html", doc.fget)
+
+    def get_doc(page):
+        # only the first access parses, later ones return the same tree
+        if page._doc is None:
+            return timed_parse(page)
+        return page._doc
+
+    try:
+        for owner, name, stage in patched:
+            setattr(owner, name, timer.wrap(stage, getattr(owner, name)))
+        scraper_lxml.MwbPage.doc = property(get_doc)
+        yield timer
+    finally:
+        for owner, name, original in originals:
+            setattr(owner, name, original)
+        scraper_lxml.MwbPage.doc = doc
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def peak_rss():
+    # includes what lxml and sqlite allocate in C, which tracemalloc can't
+    # see. ru_maxrss is in kilobytes on linux and in bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def report(name, count, seconds, peak_before, peak_after, timer, unit="words"):
+    # the peak only ever grows within a process, so the growth is what this
+    # scenario needed on top of the ones before it
+    print(
+        f"{name}: {count} {unit} in {seconds:.2f}s, {count / seconds:.1f} {unit}/s, "
+        f"peak rss {peak_after / 1024 / 1024:.1f}MB "
+        f"(+{(peak_after - peak_before) / 1024 / 1024:.1f}MB)"
+    )
+    for stage, latencies in sorted(timer.latencies.items()):
+        print(
+            f"    {stage:<16} n={len(latencies):<6}"
+            f" p50 {percentile(latencies, 0.5) * 1e3:8.3f}ms"
+            f" p99 {percentile(latencies, 0.99) * 1e3:8.3f}ms"
+        )
+
+
+def run_scenario(name, count, fn, unit="words"):
+    timer = StageTimer()
+    peak_before = peak_rss()
+    start = time.perf_counter()
+    with timed_stages(timer), open(os.devnull, "w") as devnull:
+        with redirect_stdout(devnull):
+            fn()
+    seconds = time.perf_counter() - start
+    report(name, count, seconds, peak_before, peak_rss(), timer, unit)
+
+
+def benchmark_pipeline(pages_dir=DEFAULT_PAGES_DIR, rounds=3, workers=1):
+    words = load_words(pages_dir)
+    fake_anki = FakeAnkiConnect().start()
+    anki_host = anki_helpers.ANKICONN_HOST
+    anki_helpers.ANKICONN_HOST = fake_anki.url
+
+    with tempfile.TemporaryDirectory() as tmp:
+        page_cache = PageCache(os.path.join(tmp, "pages.sqlite"), ttl=None)
+        seed_cache(page_cache, pages_dir)
+        scraper_lxml.configure_cache(page_cache, offline=True)
+
+        def generate_notes():
+            for _ in range(rounds):
+                for word in words:
+                    try:
+                        generate_default_note(word)
+                    except Exception:
+                        pass
+
+        def add_notes():
+            for i in range(rounds):
+                deck = AnkiDutchDeck(f"benchmark_{i}")
+                deck.add_note_from_list(words, workers=workers)
+
+        def update_notes():
+            for i in range(rounds):
+                update_all_notes_in_deck(
+                    f"benchmark_{i}", workers=workers, state=RefreshState(), force=True
+                )
+
+        count = rounds * len(words)
+        run_scenario("generate_default_note", count, generate_notes)
+        run_scenario("add_note_from_list", count, add_notes)
+        # words that weren't found never became notes, only notes are refreshed
+        notes = sum(
+            len(anki_helpers.find_all_notes_in_deck(f"benchmark_{i}"))
+            for i in range(rounds)
+        )
+        run_scenario("update_notes", notes, update_notes, "notes")
+
+        scraper_lxml.configure_cache(None)
+        page_cache.close()
+    fake_anki.stop()
+    anki_helpers.ANKICONN_HOST = anki_host
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="benchmarks on saved pages")
+    parser.add_argument("command", choices=["record", "extractors", "run"])
+    parser.add_argument(
+        "-d", "--pages", default=DEFAULT_PAGES_DIR, help="directory of saved pages"
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        default=DEFAULT_WORDS_FILE,
+        help="file containing words to record",
+    )
+    parser.add_argument(
+        "-n", "--number", type=int, default=100, help="repetitions per page"
+    )
+    parser.add_argument(
+        "-r", "--rounds", type=int, default=3, help="repetitions of the word list"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1, help="number of scrape workers"
+    )
+    args = parser.parse_args()
+
+    if args.command != "record" and not os.path.isdir(args.pages):
+        parser.error(
+            f"no saved pages in {args.pages}/, record them first with "
+            f"`python benchmark.py record` (needs access to mijnwoordenboek.nl)"
+        )
+
+    if args.command == "record":
+        words = [w.strip() for w in open(args.file) if w.strip() != ""]
+        record_pages(words, args.pages)
+    elif args.command == "extractors":
+        benchmark_extractors(load_pages(args.pages), args.number)
+    elif args.command == "run":
+        benchmark_pipeline(args.pages, args.rounds, args.workers)
@@ -0,0 +1 @@
+# lets pytest import the modules in this directory from tests/
@@ -0,0 +1,269 @@
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lexicon import DEFAULT_LEXICON_PATH
+from utils import normalize_word
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8766
+
+
+class AddResults:
+    # stands in for the journal while one request is handled, so every word's
+    # outcome can be sent back to the client
+    def __init__(self, journal=None):
+        self.journal = journal
+        self.statuses = []
+
+    def is_completed(self, word):
+        return False
+
+    def record(self, word, status):
+        self.statuses.append((word, status))
+        if self.journal is not None:
+            self.journal.record(word, status)
+
+
+class WordAdder:
+    def __init__(self, deck, workers=1, output_file=None, journal=None):
+        self.deck = deck
+        self.workers = workers
+        self.output_file = output_file
+        self.journal = journal
+        # the deck keeps per run state, requests are handled one at a time
+        self.lock = threading.Lock()
+
+    def add(self, words):
+        results = AddResults(self.journal)
+        with self.lock:
+            self.deck.add_note_from_list(
+                words,
+                self.output_file,
+                self.workers,
+                journal=results,
+                preflight=False,
+            )
+        if self.journal is not None:
+            self.journal.flush()
+
+        # words that weren't found are recorded before the batch is written
+        order = {normalize_word(w): i for i, w in reversed(list(enumerate(words)))}
+        return sorted(results.statuses, key=lambda s: order.get(s[0], len(order)))
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": "not found"})
+            return
+        self.send_json(200, {"deck": self.server.adder.deck.deck_name})
+
+    def do_POST(self):
+        if self.path != "/add":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            words = request["words"]
+        except (TypeError, ValueError, KeyError) as e:
+            self.send_json(400, {"error": f"bad request: {e}"})
+            return
+
+        try:
+            statuses = self.server.adder.add(words)
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+            return
+        self.send_json(200, {"results": statuses})
+
+    def send_json(self, status, body):
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else "local"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def make_server(adder, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    if socket_path is not None:
+        server = UnixHTTPServer(socket_path, DaemonHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), DaemonHandler)
+    server.adder = adder
+    return server
+
+
+def request(
+    method, path, body=None, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None
+):
+    if socket_path is not None:
+        conn = UnixHTTPConnection(socket_path)
+    else:
+        conn = http.client.HTTPConnection(host, port, timeout=60)
+    try:
+        payload = None if body is None else json.dumps(body)
+        conn.request(method, path, payload, {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        result = json.loads(response.read())
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise Exception(result.get("error", f"daemon answered {response.status}"))
+    return result
+
+
+def add_words(words, **kwargs):
+    return request("POST", "/add", {"words": words}, **kwargs)["results"]
+
+
+def serve(args):
+    # the heavy imports only happen in the daemon, the client stays stdlib only
+    from add_cards import AnkiDutchDeck
+    from journal import Journal
+    from lexicon import Lexicon
+    from page_cache import PageCache, DEFAULT_CACHE_PATH
+    from scraper_lxml import (
+        configure_cache,
+        configure_fetch_client,
+        configure_lexicon,
+        DEFAULT_REQUESTS_PER_SECOND,
+    )
+
+    if not args.no_cache:
+        configure_cache(PageCache(args.cache or DEFAULT_CACHE_PATH))
+    configure_fetch_client(requests_per_second=args.rate or DEFAULT_REQUESTS_PER_SECOND)
+    if args.lexicon is not None:
+        configure_lexicon(Lexicon(args.lexicon))
+
+    deck = AnkiDutchDeck(args.deck)
+    journal = None
+    if args.journal is not None:
+        # appended to, so restarting the daemon keeps the earlier outcomes
+        journal = Journal(args.journal, resume=True, scope=deck.deck_name)
+    adder = WordAdder(deck, args.workers, args.output, journal)
+    server = make_server(adder, args.host, args.port, args.socket)
+    where = args.socket or f"http://{args.host}:{args.port}"
+    print(f"adding words to deck {adder.deck.deck_name}, listening on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+        if journal is not None:
+            journal.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    # both commands need to agree on where the daemon listens
+    address_parser = argparse.ArgumentParser(add_help=False)
+    address_parser.add_argument(
+        "--host", default=DEFAULT_HOST, help="address the daemon listens on"
+    )
+    address_parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help="port the daemon listens on"
+    )
+    address_parser.add_argument(
+        "--socket", help="unix socket the daemon listens on instead"
+    )
+
+    parser = argparse.ArgumentParser(description="keep add_cards.py running")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser(
+        "serve", parents=[address_parser], help="run the daemon"
+    )
+    serve_parser.add_argument("-d", "--deck", help="name of deck")
+    serve_parser.add_argument("-o", "--output", help="output unfound words to file")
+    serve_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of words fetched and parsed in parallel",
+    )
+    serve_parser.add_argument(
+        "--cache", help="file to cache scraped pages in, defaults to add_cards.py's"
+    )
+    serve_parser.add_argument(
+        "--no-cache", action="store_true", help="always fetch pages from the web"
+    )
+    serve_parser.add_argument(
+        "--lexicon",
+        nargs="?",
+        const=DEFAULT_LEXICON_PATH,
+        help="look up words in a local store of generated notes before scraping",
+    )
+    serve_parser.add_argument(
+        "--journal", help="also append the outcome of every word to this file"
+    )
+    serve_parser.add_argument(
+        "--rate",
+        type=float,
+        help="maximum number of requests per second to mijnwoordenboek, "
+        "defaults to add_cards.py's",
+    )
+
+    add_parser = commands.add_parser(
+        "add", parents=[address_parser], help="send words to the daemon"
+    )
+    add_parser.add_argument("words", nargs="+", help="words to add")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args)
+    else:
+        try:
+            results = add_words(
+                args.words, host=args.host, port=args.port, socket_path=args.socket
+            )
+        except Exception as e:
+            print(f"could not add words: {e}")
+            sys.exit(1)
+        for word, status in results:
+            print(f"{word}: {status}")
+        if any(status == "failed" for _, status in results):
+            sys.exit(1)
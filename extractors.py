@@ -0,0 +1,108 @@
+import re
+
+from lxml.etree import XPath
+
+
+TEXT_CONTAINING = XPath("//text()[contains(., $text)]")
+CHILD_TEXT = XPath("text()")
+
+HEADWORDS = XPath('//div/h2[@class="inline"]')
+HEADWORD_FORMS = XPath("following-sibling::table[1]/tr")
+
+EXPLANATIONS_ENGLISH = XPath('//div/font[@style="color:navy;font-size:10pt"]')
+EXPLANATION_DUTCH = XPath("preceding-sibling::font[1]")
+
+EXAMPLES_DUTCH = XPath('//i/font[@style="color:#422526"]')
+EXAMPLES_ENGLISH = XPath('//i/following-sibling::font[@style="color:navy"]')
+
+OTHER_EXPLANATIONS_ENGLISH = XPath(
+    '//table[@border=0]/tr/td[@style="padding-left:20px"]'
+)
+OTHER_EXPLANATION_DUTCH = XPath("preceding-sibling::*")
+
+SCRIPTS = XPath("//script")
+OTHER_EXAMPLES = XPath("//ol/li")
+
+EXPRESSION_START = XPath('//a[starts-with(@onclick, "shoh")]')
+EXPRESSION_ANCHORS = XPath('//a[contains(@onclick, "shoh")]')
+EXPRESSION = XPath("following-sibling::font[1]")
+EQUIVALENTS = XPath('//font[@style="color:darkgreen"]')
+EQUIVALENT_TRANSLATION = XPath('following-sibling::font[@style="color:navy"][1]')
+EQUIVALENT_EXAMPLES = XPath('following-sibling::font[@style="color:#444"]')
+EXAMPLE_TRANSLATIONS = XPath('following-sibling::font[@style="color:navy"]')
+
+SIMPLE_DUTCH = XPath("//table[@border=0]/tr[1]/td[1]")
+SIMPLE_EXPLANATION = XPath("//table[@border=0]/tr[1]/td[2]")
+
+
+def follow(section, nodes, relative):
+    # same nodes as the xpath union "nodes/relative", in document order
+    found = set()
+    for node in nodes:
+        found.update(x for x in relative(node) if x in section)
+    return sorted(found, key=section.page.position)
+
+
+def text_contents(nodes):
+    return [x.text_content() for x in nodes]
+
+
+def extract_headwords(section):
+    headwords = section.select(HEADWORDS)
+    parents = follow(section, headwords, lambda h: [h.getparent()])
+
+    part_of_speech = [t for p in parents for t in CHILD_TEXT(p) if t in section]
+    forms = follow(section, headwords, HEADWORD_FORMS)
+    return text_contents(headwords), part_of_speech, text_contents(forms)
+
+
+def extract_explanations(section):
+    english = section.select(EXPLANATIONS_ENGLISH)
+    dutch = follow(section, english, EXPLANATION_DUTCH)
+    return text_contents(dutch), text_contents(english)
+
+
+def extract_examples(section):
+    dutch = section.select(EXAMPLES_DUTCH)
+    english = section.select(EXAMPLES_ENGLISH)
+    return text_contents(dutch), text_contents(english)
+
+
+def extract_other_explanations(section):
+    english = section.select(OTHER_EXPLANATIONS_ENGLISH)
+    dutch = follow(section, english, OTHER_EXPLANATION_DUTCH)
+    return text_contents(dutch), text_contents(english)
+
+
+# the "other sources" examples are loaded by $("#zinnendiv").load("...")
+EXAMPLES_URL = re.compile(r'zinnendiv"\)\.load\("([^"]+)"\)')
+
+
+def find_examples_url(html_content):
+    # a cheap look at the raw page, before it is parsed. it only knows the
+    # usual form of the script, anything else is left to extract_examples_url
+    match = EXAMPLES_URL.search(html_content)
+    return match.group(1) if match is not None else None
+
+
+def extract_examples_url(section):
+    scripts = [x.text_content() for x in section.select(SCRIPTS)]
+    script = [x for x in scripts if "zinnendiv" in x][0]
+    return script.split('load("')[-1].split('");')[0]
+
+
+def extract_expressions(section):
+    anchors = section.select(EXPRESSION_ANCHORS)
+    equivalents = section.select(EQUIVALENTS)
+    examples_dutch = follow(section, equivalents, EQUIVALENT_EXAMPLES)
+
+    expressions = follow(section, anchors, EXPRESSION)
+    translations = follow(section, equivalents, EQUIVALENT_TRANSLATION)
+    examples_english = follow(section, examples_dutch, EXAMPLE_TRANSLATIONS)
+    return (
+        text_contents(expressions),
+        text_contents(equivalents),
+        text_contents(translations),
+        text_contents(examples_dutch),
+        text_contents(examples_english),
+    )
@@ -0,0 +1,196 @@
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+ANKICONN_VERSION = 6
+
+
+class FakeCollection:
+    def __init__(self):
+        self.decks = {"Default"}
+        self.models = {}
+        self.notes = {}
+        self.next_id = int(time.time() * 1000)
+        self.lock = threading.Lock()
+
+    def invoke(self, action, **params):
+        with self.lock:
+            return self.invoke_unlocked(action, params)
+
+    def invoke_unlocked(self, action, params):
+        handler = getattr(self, f"action_{action}", None)
+        if handler is None:
+            raise Exception("unsupported action")
+        return handler(**params)
+
+    def action_version(self):
+        return ANKICONN_VERSION
+
+    def action_deckNames(self):
+        return sorted(self.decks)
+
+    def action_createDeck(self, deck):
+        self.decks.add(deck)
+        return len(self.decks)
+
+    def action_modelNames(self):
+        return sorted(self.models)
+
+    def action_createModel(self, modelName, inOrderFields, cardTemplates, **kwargs):
+        if modelName in self.models:
+            raise Exception("Model name already exists")
+        self.models[modelName] = list(inOrderFields)
+        return {"name": modelName, "flds": inOrderFields, "tmpls": cardTemplates}
+
+    def action_addNote(self, note):
+        if note["deckName"] not in self.decks:
+            raise Exception(f"deck was not found: {note['deckName']}")
+        if note["modelName"] not in self.models:
+            raise Exception(f"model was not found: {note['modelName']}")
+
+        field_names = self.models[note["modelName"]]
+        first_field = note["fields"].get(field_names[0], "")
+        for existing in self.notes.values():
+            if (
+                existing["modelName"] == note["modelName"]
+                and existing["deckName"] == note["deckName"]
+                and existing["fields"].get(field_names[0]) == first_field
+            ):
+                raise Exception("cannot create note because it is a duplicate")
+
+        self.next_id += 1
+        self.notes[self.next_id] = {
+            "noteId": self.next_id,
+            "deckName": note["deckName"],
+            "modelName": note["modelName"],
+            "fields": {name: note["fields"].get(name, "") for name in field_names},
+            "tags": list(note.get("tags", [])),
+            "mod": int(time.time()),
+        }
+        return self.next_id
+
+    def action_findNotes(self, query):
+        terms = query.split()
+        deck_name = None
+        if terms and terms[0].startswith("deck:"):
+            deck_name = terms.pop(0)[len("deck:") :]
+
+        results = []
+        for note_id, note in self.notes.items():
+            if deck_name is not None and note["deckName"] != deck_name:
+                continue
+            text = " ".join(note["fields"].values())
+            if all(term in text for term in terms):
+                results.append(note_id)
+        return results
+
+    def action_notesInfo(self, notes):
+        results = []
+        for note_id in notes:
+            note = self.notes.get(note_id)
+            if note is None:
+                results.append({})
+                continue
+            field_names = self.models[note["modelName"]]
+            results.append(
+                {
+                    "noteId": note_id,
+                    "modelName": note["modelName"],
+                    "tags": note["tags"],
+                    "fields": {
+                        name: {"value": note["fields"][name], "order": order}
+                        for order, name in enumerate(field_names)
+                    },
+                    "mod": note["mod"],
+                }
+            )
+        return results
+
+    def action_updateNoteFields(self, note):
+        existing = self.notes.get(note["id"])
+        if existing is None:
+            raise Exception("note was not found")
+        for name, value in note["fields"].items():
+            if name in existing["fields"]:
+                existing["fields"][name] = value
+        existing["mod"] = int(time.time())
+
+    def action_multi(self, actions):
+        # like anki-connect, actions without a version of at least 5 only get
+        # their result back, an error becomes None
+        results = []
+        for action in actions:
+            try:
+                result = self.invoke_unlocked(
+                    action["action"], action.get("params", {})
+                )
+                reply = {"result": result, "error": None}
+            except Exception as e:
+                reply = {"result": None, "error": str(e)}
+            if action.get("version", 4) <= 4:
+                reply = reply["result"]
+            results.append(reply)
+        return results
+
+
+class FakeAnkiConnectHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length))
+        try:
+            result = self.server.collection.invoke(
+                request["action"], **request.get("params", {})
+            )
+            response = {"result": result, "error": None}
+        except Exception as e:
+            response = {"result": None, "error": str(e)}
+
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeAnkiConnect:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.collection = FakeCollection()
+        self.server = ThreadingHTTPServer((host, port), FakeAnkiConnectHandler)
+        self.server.daemon_threads = True
+        self.server.collection = self.collection
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="stand-in for anki with ankiconnect")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    args = parser.parse_args()
+
+    fake = FakeAnkiConnect(port=args.port)
+    print(f"fake ankiconnect listening on {fake.url}")
+    fake.server.serve_forever()
@@ -0,0 +1,73 @@
+import os
+import threading
+
+
+ADDED = "added"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+DUPLICATE = "duplicate"
+NOT_FOUND = "not_found"
+FAILED = "failed"
+
+# words and notes with these outcomes are skipped when resuming
+COMPLETED = {ADDED, UPDATED, UNCHANGED, DUPLICATE, NOT_FOUND}
+
+FLUSH_EVERY = 50
+
+
+class Journal:
+    # every line is "status<tab>scope<tab>key". the scope is the deck, so
+    # resuming with another deck doesn't skip words handled for the first one
+    def __init__(self, path, resume=False, scope=""):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.scope = scope
+        self.completed = set()
+        if resume and os.path.exists(path):
+            self.completed = self.load(path, scope)
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+        self.unflushed = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def load(path, scope=""):
+        outcomes = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t", 2)
+                if len(parts) == 2:
+                    # journals written before scopes belong to no deck
+                    parts.insert(1, "")
+                status, entry_scope, key = parts
+                if entry_scope == scope:
+                    outcomes[key] = status
+        return {key for key, status in outcomes.items() if status in COMPLETED}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def is_completed(self, key):
+        return str(key) in self.completed
+
+    def record(self, key, status):
+        with self.lock:
+            self.file.write(f"{status}\t{self.scope}\t{key}\n")
+            self.unflushed += 1
+            if self.unflushed >= FLUSH_EVERY:
+                self.file.flush()
+                self.unflushed = 0
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+            self.unflushed = 0
+
+    def close(self):
+        with self.lock:
+            self.file.close()
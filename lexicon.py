@@ -0,0 +1,138 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from page_cache import DEFAULT_CACHE_PATH
+from utils import normalize_word
+
+
+DEFAULT_LEXICON_PATH = os.path.join(
+    os.path.dirname(DEFAULT_CACHE_PATH), "lexicon.sqlite"
+)
+
+HEADWORD = 0
+INFLECTION = 1
+
+StoredNote = namedtuple("StoredNote", ["fields", "is_default_model"])
+
+
+def lexicon_key(word):
+    return normalize_word(word).casefold()
+
+
+def note_forms(word, note_fields):
+    # (form, kind) pairs a stored note can be found by. only the word it was
+    # looked up with is its headword, the other words in the Dutch field and
+    # the forms listed in Misc can be words of their own
+    headword = lexicon_key(word)
+    forms = {lexicon_key(w) for w in note_fields["Dutch"].split(";")}
+
+    # Misc starts with the part of speech, then pronunciation ([...]) and
+    # lines like "meervoud: fietsen" or "liep, gelopen"
+    for line in note_fields.get("Misc", "").split("<br>")[1:]:
+        line = line.strip()
+        if not line or line.startswith("["):
+            continue
+        for form in line.split(":")[-1].split(","):
+            forms.add(lexicon_key(form))
+
+    forms.discard("")
+    forms.discard(headword)
+    return {(headword, HEADWORD)} | {(form, INFLECTION) for form in forms}
+
+
+class Lexicon:
+    def __init__(self, path=DEFAULT_LEXICON_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY,
+                headword TEXT NOT NULL UNIQUE,
+                fields TEXT NOT NULL,
+                is_default INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0
+            )""")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(entries)")]
+        if "version" not in columns:
+            # lexicons from before versions were stored, their notes are
+            # never served again
+            self.conn.execute(
+                "ALTER TABLE entries ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+            )
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS forms (
+                form TEXT NOT NULL,
+                kind INTEGER NOT NULL,
+                entry_id INTEGER NOT NULL,
+                PRIMARY KEY (form, kind, entry_id)
+            ) WITHOUT ROWID""")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS forms_entry_id ON forms (entry_id)"
+        )
+        self.conn.commit()
+
+    def lookup(self, word, match_forms=False, version=0):
+        # only notes generated by the same version are served. headwords win
+        # over inflections, newer entries over older ones
+        with self.lock:
+            if match_forms:
+                row = self.conn.execute(
+                    """SELECT entries.fields, entries.is_default FROM forms
+                    JOIN entries ON entries.id = forms.entry_id
+                    WHERE forms.form = ? AND entries.version = ?
+                    ORDER BY forms.kind, entries.stored_at DESC LIMIT 1""",
+                    (lexicon_key(word), version),
+                ).fetchone()
+            else:
+                row = self.conn.execute(
+                    "SELECT fields, is_default FROM entries "
+                    "WHERE headword = ? AND version = ?",
+                    (lexicon_key(word), version),
+                ).fetchone()
+        if row is None:
+            return None
+        return StoredNote(json.loads(row[0]), bool(row[1]))
+
+    def store(self, word, note_fields, is_default_model, version=0):
+        key = lexicon_key(word)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id FROM entries WHERE headword = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self.conn.execute("DELETE FROM forms WHERE entry_id = ?", row)
+                self.conn.execute("DELETE FROM entries WHERE id = ?", row)
+
+            cursor = self.conn.execute(
+                "INSERT INTO entries "
+                "(headword, fields, is_default, stored_at, version) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    key,
+                    json.dumps(note_fields),
+                    int(is_default_model),
+                    time.time(),
+                    version,
+                ),
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO forms VALUES (?, ?, ?)",
+                [
+                    (form, kind, cursor.lastrowid)
+                    for form, kind in note_forms(word, note_fields)
+                ],
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "ankiDutchNotes", "pages.sqlite"
+)
+DEFAULT_TTL = 30 * 24 * 60 * 60
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# a full cache is trimmed to this fraction of max_bytes, so the next puts
+# don't have to evict again right away
+LOW_WATER_MARK = 0.9
+EVICT_BATCH_SIZE = 64
+
+
+def url_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+class PageCache:
+    def __init__(
+        self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES
+    ):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                content BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)"
+        )
+        self.conn.commit()
+        # kept up to date by put and evict instead of summing on every put
+        (self.total_bytes,) = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM pages"
+        ).fetchone()
+
+    def get(self, url, ignore_ttl=False):
+        key = url_key(url)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT content, fetched_at FROM pages WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            content, fetched_at = row
+            if not ignore_ttl and self.ttl is not None and now - fetched_at > self.ttl:
+                return None
+
+            self.conn.execute(
+                "UPDATE pages SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.conn.commit()
+        return zlib.decompress(content)
+
+    def put(self, url, content):
+        compressed = zlib.compress(content)
+        now = time.time()
+        key = url_key(url)
+        with self.lock:
+            replaced = self.conn.execute(
+                "SELECT size FROM pages WHERE key = ?", (key,)
+            ).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (key, url, compressed, len(compressed), now, now),
+            )
+            self.total_bytes += len(compressed) - (replaced[0] if replaced else 0)
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        if self.max_bytes is None or self.total_bytes <= self.max_bytes:
+            return
+
+        # drop least recently used pages, a batch at a time through the
+        # accessed_at index, until the cache is below the low water mark
+        low_water = self.max_bytes * LOW_WATER_MARK
+        while self.total_bytes > low_water:
+            rows = self.conn.execute(
+                "SELECT key, size FROM pages ORDER BY accessed_at LIMIT ?",
+                (EVICT_BATCH_SIZE,),
+            ).fetchall()
+            if not rows:
+                self.total_bytes = 0
+                return
+            to_delete = []
+            for key, size in rows:
+                if self.total_bytes <= low_water:
+                    break
+                to_delete.append((key,))
+                self.total_bytes -= size
+            self.conn.executemany("DELETE FROM pages WHERE key = ?", to_delete)
+
+    def items(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT url, content FROM pages").fetchall()
+        return [(url, zlib.decompress(content)) for url, content in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
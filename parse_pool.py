@@ -0,0 +1,97 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from page_cache import PageCache
+from scraper_lxml import (
+    MwbPage,
+    configure_cache,
+    configure_fetch_client,
+    generate_note,
+    DEFAULT_REQUESTS_PER_SECOND,
+)
+
+
+DEFAULT_CHUNK_SIZE = 16
+
+
+def _init_worker(cache_path, offline, requests_per_second):
+    # runs once per worker process, lxml is imported with scraper_lxml. pages
+    # for the "other sources" examples can still be fetched from here
+    if cache_path is not None:
+        configure_cache(PageCache(cache_path), offline)
+    configure_fetch_client(requests_per_second=requests_per_second)
+
+
+def _parse_chunk(chunk):
+    results = []
+    for word, content in chunk:
+        try:
+            results.append(generate_note(word, MwbPage(word, content)))
+        except Exception as e:
+            print(f'failed to generate a note for "{word}": {e}')
+            results.append((None, None))
+    return results
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def is_page(page):
+    return isinstance(page, MwbPage)
+
+
+class ParsePool:
+    def __init__(
+        self,
+        workers,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        cache_path=None,
+        offline=False,
+        requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+    ):
+        self.workers = max(1, workers)
+        self.chunk_size = max(1, chunk_size)
+        # workers are started fresh instead of forked from a process that
+        # already runs the pipeline threads
+        self.executor = ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(cache_path, offline, requests_per_second / self.workers),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def map(self, pages):
+        # pages are (key, MwbPage or None) pairs. only the raw bytes go to the
+        # workers, a chunk at a time, and (key, (fields, is_default_model)) comes
+        # back in input order. anything that isn't a page (None, or a note
+        # served from the lexicon) is passed through as it is
+        pending = deque()
+        for chunk in chunked(pages, self.chunk_size):
+            contents = [(p.word, p.content) for _, p in chunk if is_page(p)]
+            pending.append((chunk, self.executor.submit(_parse_chunk, contents)))
+            if len(pending) >= 2 * self.workers:
+                yield from self.results(*pending.popleft())
+        while pending:
+            yield from self.results(*pending.popleft())
+
+    def results(self, chunk, future):
+        parsed = iter(future.result())
+        for key, page in chunk:
+            yield key, next(parsed) if is_page(page) else page
+
+    def close(self):
+        self.executor.shutdown()
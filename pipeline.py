@@ -0,0 +1,77 @@
+import queue
+import threading
+
+from utils import bounded_map, normalize_word
+
+
+DEFAULT_QUEUE_SIZE = 64
+
+_DONE = object()
+
+
+class _StageError:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def threaded(iterable, queue_size=DEFAULT_QUEUE_SIZE):
+    # runs the iterable in its own thread, at most queue_size items ahead
+    items = queue.Queue(maxsize=queue_size)
+
+    def run():
+        try:
+            for item in iterable:
+                items.put(item)
+        except BaseException as e:
+            items.put(_StageError(e))
+            return
+        items.put(_DONE)
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is _DONE:
+            return
+        if isinstance(item, _StageError):
+            raise item.exception
+        yield item
+
+
+def read_words(lines):
+    # words are normalized before anything else, so variants like "de fiets"
+    # and "fiets" are deduplicated and fetched once
+    for line in lines:
+        word = normalize_word(line)
+        if word != "":
+            yield word
+
+
+def dedupe(words):
+    # the one part that grows with the input, one entry per distinct word
+    seen = set()
+    for word in words:
+        if word not in seen:
+            seen.add(word)
+            yield word
+
+
+def run_pipeline(
+    lines,
+    fetch,
+    parse,
+    workers=1,
+    queue_size=DEFAULT_QUEUE_SIZE,
+    skip=None,
+    parse_map=None,
+):
+    # read -> normalize/dedupe -> fetch -> parse. every queue between the
+    # stages is bounded, so pages and notes never pile up, and results come
+    # out in input order. only dedupe keeps every distinct word
+    words = dedupe(read_words(lines))
+    if skip is not None:
+        words = (word for word in words if not skip(word))
+    words = threaded(words, queue_size)
+    pages = threaded(bounded_map(fetch, words, max(1, workers)), queue_size)
+    # parse_map replaces the per page parse, e.g. with a process pool
+    parsed = map(parse, pages) if parse_map is None else parse_map(pages)
+    return threaded(parsed, queue_size)
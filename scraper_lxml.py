@@ -1,107 +1,436 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, zip_longest
+
 import requests
 import lxml.html
+from requests.adapters import HTTPAdapter
+
+import extractors
+from stats import STATS, timed
 from utils import (
     join_with_br,
-    get_html_table,
-    pad_list,
+    write_html_rows,
+    write_html_table,
     NoExampleException,
     NoExplanationException,
+    PageNotCachedException,
+    SingleFlight,
+    normalize_word,
 )
 
 
 ERR_STRING = "We hebben geen vertalingen voor"
 # UITDRUKKING_DEEL = "deel van de uitdrukking"
 UITDRUKKING_DEEL = '<a onClick="shoh'
+# example sentences on the main page, and the page with the other ones
+EXAMPLES_MARKER = 'style="color:#422526"'
+# bump whenever a change to the parsing or the tables changes the generated
+# fields, so notes generated before are generated again
+NOTE_VERSION = 1
+
+
+DEFAULT_REQUESTS_PER_SECOND = 4.0
+DEFAULT_MAX_CONCURRENCY = 8
+# longest wait between attempts, a server asking for more fails the request
+DEFAULT_MAX_BACKOFF = 60.0
+DEFAULT_MAX_WASTED_PREFETCHES = 8
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    # additive increase while requests are fast, multiplicative decrease when
+    # they slow down or the site pushes back
+    def __init__(self, max_limit, target_latency=2.0):
+        self.max_limit = max(1, max_limit)
+        self.limit = min(2, self.max_limit)
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+            elif latency is not None and latency > self.target_latency:
+                self.limit = max(1, self.limit - 1)
+            elif latency is not None:
+                self.limit = min(self.max_limit, self.limit + 1)
+            self.condition.notify_all()
+
+
+class FetchClient:
+    def __init__(
+        self,
+        requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        timeout=(5, 30),
+        retries=4,
+        backoff_factor=1.0,
+        max_backoff=DEFAULT_MAX_BACKOFF,
+        target_latency=2.0,
+    ):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.bucket = TokenBucket(requests_per_second)
+        self.limiter = AdaptiveLimiter(max_concurrency, target_latency)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+    def backoff(self, attempt, response=None):
+        # seconds to wait before the next attempt, None when the server asks
+        # for longer than max_backoff
+        retry_after = None
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+        if retry_after is not None and retry_after.isdigit():
+            delay = float(retry_after)
+            return delay if delay <= self.max_backoff else None
+        delay = self.backoff_factor * 2**attempt * (1 + random.random())
+        return min(delay, self.max_backoff)
+
+    def get(self, url):
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            self.limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                self.limiter.release(throttled=True)
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff(attempt))
+                continue
+
+            throttled = response.status_code == 429 or response.status_code >= 500
+            self.limiter.release(time.monotonic() - start, throttled)
+            if not throttled:
+                # only 2xx pages are returned and cached, error pages like a
+                # 403 or a stray 304 raise
+                if not 200 <= response.status_code < 300:
+                    response.raise_for_status()
+                    raise requests.HTTPError(
+                        f"{response.status_code} for url: {url}", response=response
+                    )
+                return response.content
+            delay = self.backoff(attempt, response)
+            if attempt == self.retries or delay is None:
+                response.raise_for_status()
+            time.sleep(delay)
+
+
+_fetch_client = None
+_fetch_client_lock = threading.Lock()
+
+
+def configure_fetch_client(**kwargs):
+    global _fetch_client
+    _fetch_client = FetchClient(**kwargs)
+    return _fetch_client
+
+
+def get_fetch_client():
+    global _fetch_client
+    with _fetch_client_lock:
+        if _fetch_client is None:
+            _fetch_client = FetchClient()
+    return _fetch_client
+
+
+_page_cache = None
+_offline = False
+_fetch_flights = SingleFlight(name="fetch")
+
+
+def configure_cache(page_cache=None, offline=False):
+    global _page_cache, _offline
+    if offline and page_cache is None:
+        raise ValueError("offline mode needs a page cache")
+    _page_cache = page_cache
+    _offline = offline
+
+
+def fetch_url(url):
+    # concurrent requests for the same url share one cache lookup and fetch
+    return _fetch_flights.do(url, lambda: _fetch_url(url))
+
+
+def _fetch_url(url):
+    if _page_cache is not None:
+        with STATS.timer("page cache get"):
+            content = _page_cache.get(url, ignore_ttl=_offline)
+        if content is not None:
+            STATS.count("page cache hit")
+            return content
+        STATS.count("page cache miss")
+
+    if _offline:
+        raise PageNotCachedException(f"[{url}] is not in the page cache")
+
+    with STATS.timer("fetch", url=url):
+        content = get_fetch_client().get(url)
+    if _page_cache is not None:
+        _page_cache.put(url, content)
+    return content
+
+
+def get_mwb_url(word):
+    return f"https://www.mijnwoordenboek.nl/vertaal/nl/en/{word}"
 
 
 def get_mwb_html(word):
-    url = f"https://www.mijnwoordenboek.nl/vertaal/nl/en/{word}"
-    html = requests.get(url)
-    return html
+    return fetch_url(get_mwb_url(word))
 
 
-class NoteExpression:
-    def __init__(self, input_word, html_content):
-        self.input_word = input_word
+def get_cached_mwb_html(word):
+    if _page_cache is None:
+        return None
+    return _page_cache.get(get_mwb_url(word), ignore_ttl=_offline)
+
+
+class MwbPage:
+    def __init__(self, word, content):
+        self.word = word
+        self.content = content
+        self.html_content = content.decode("utf-8")
+        self._doc = None
+        self._positions = None
+        self.prefetched = {}
+
+    @property
+    def doc(self):
+        if self._doc is None:
+            with STATS.timer("lxml.html.fromstring"):
+                self._doc = lxml.html.fromstring(self.html_content)
+        return self._doc
+
+    @property
+    def positions(self):
+        # document order of every element, computed in a single walk
+        if self._positions is None:
+            self._positions = {el: i for i, el in enumerate(self.doc.iter())}
+        return self._positions
+
+    def position(self, node):
+        if not isinstance(node, str):
+            return self.positions[node]
+
+        parent = node.getparent()
+        if not node.is_tail:
+            return self.positions[parent]
+        # a tail comes after the last descendant of its element
+        for last in parent.iter():
+            pass
+        return self.positions[last] + 0.5
+
+    def find_text(self, text):
+        nodes = extractors.TEXT_CONTAINING(self.doc, text=text)
+        if not nodes:
+            return None
+        return self.position(nodes[0])
+
+    def section(self, start_text, end_text=None):
+        end = len(self.positions)
+        if end_text is not None:
+            end_position = self.find_text(end_text)
+            if end_position is not None:
+                end = end_position
+
+        start = self.find_text(start_text)
+        if start is None:
+            start = end
+        return PageSection(self, start, end)
+
+    def expression_section(self):
+        anchors = extractors.EXPRESSION_START(self.doc)
+        end = len(self.positions)
+        start = self.position(anchors[0]) if anchors else end
+        return PageSection(self, start, end)
+
+
+class PageSection:
+    def __init__(self, page, start, end):
+        self.page = page
+        self.start = start
+        self.end = end
+
+    def __contains__(self, node):
+        return self.start <= self.page.position(node) < self.end
+
+    def select(self, xpath, **variables):
+        return [x for x in xpath(self.page.doc, **variables) if x in self]
+
+    def contains_text(self, text):
+        return bool(self.select(extractors.TEXT_CONTAINING, text=text))
+
+
+class Prefetcher:
+    # when the raw page already shows that there are no example sentences, the
+    # "other sources" examples page is fetched right away instead of after the
+    # main page was parsed. a prefetch that nobody used takes one unit of the
+    # budget and a used one gives it back, prefetching stops while it's spent
+    def __init__(
+        self, max_wasted=DEFAULT_MAX_WASTED_PREFETCHES, workers=DEFAULT_MAX_CONCURRENCY
+    ):
+        self.max_wasted = max_wasted
+        self.wasted = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def prefetch(self, page):
+        html_content = page.html_content
+        if ERR_STRING in html_content or EXAMPLES_MARKER in html_content:
+            return
+        examples_url = extractors.find_examples_url(html_content)
+        if examples_url is None:
+            return
+
+        with self.lock:
+            if self.wasted >= self.max_wasted:
+                STATS.count("prefetch skipped")
+                return
+        STATS.count("prefetch started")
+        page.prefetched[examples_url] = self.executor.submit(fetch_url, examples_url)
+
+    def take(self, page, url):
+        future = page.prefetched.pop(url, None)
+        if future is None:
+            return None
+        with self.lock:
+            self.wasted = max(0, self.wasted - 1)
+        STATS.count("prefetch used")
+        return future.result()
 
-        start_idx = html_content.find(UITDRUKKING_DEEL)
-        self.html_content = html_content[start_idx:]
-        self.doc = lxml.html.fromstring(self.html_content)
+    def release(self, page):
+        # the pages still finish and end up in the page cache
+        with self.lock:
+            self.wasted += len(page.prefetched)
+        STATS.count("prefetch wasted", len(page.prefetched))
+        page.prefetched = {}
 
-    def parse_expression(self):
-        expressions = [
-            x.text_content()
-            for x in self.doc.xpath(
-                '//a[contains(@onclick, "shoh")]/following-sibling::font[1]'
-            )
-        ]
 
-        equivalents = [
-            x.text_content() for x in self.doc.xpath('//font[@style="color:darkgreen"]')
-        ]
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
 
-        translations = [
-            x.text_content()
-            for x in self.doc.xpath(
-                '//font[@style="color:darkgreen"]/following-sibling::font[@style="color:navy"][1]'
-            )
-        ]
 
-        # TODO exact match??
-        target_length = max(len(expressions), len(equivalents), len(translations))
-        expressions = pad_list(expressions, target_length)
-        equivalents = pad_list(equivalents, target_length)
-        translations = pad_list(translations, target_length)
+def configure_prefetcher(**kwargs):
+    global _prefetcher
+    with _prefetcher_lock:
+        _prefetcher = Prefetcher(**kwargs)
+    return _prefetcher
 
-        return expressions, equivalents, translations
 
-    def parse_examples(self):
-        examples_dutch = [
-            x.text_content()
-            for x in self.doc.xpath(
-                '//font[@style="color:darkgreen"]/following-sibling::font[@style="color:#444"]'
-            )
-        ]
-        examples_english = [
-            x.text_content()
-            for x in self.doc.xpath(
-                '//font[@style="color:darkgreen"]/following-sibling::font[@style="color:#444"]/following-sibling::font[@style="color:navy"]'
-            )
-        ]
+def get_prefetcher():
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher()
+    return _prefetcher
+
+
+def fetch_mwb_page(word):
+    page = MwbPage(word, get_mwb_html(word))
+    # prefetching only pays off when pages come from the network
+    if not _offline:
+        get_prefetcher().prefetch(page)
+    return page
+
+
+class NoteExpression:
+    def __init__(self, input_word, page):
+        self.input_word = input_word
+
+        self.doc = page.expression_section()
+        self._fields = None
 
-        # TODO exact match??
-        target_length = max(len(examples_dutch), len(examples_english))
-        examples_english = pad_list(examples_english, target_length)
-        examples_dutch = pad_list(examples_dutch, target_length)
+    @property
+    def fields(self):
+        # expressions and their examples are collected in one pass
+        if self._fields is None:
+            self._fields = extractors.extract_expressions(self.doc)
+        return self._fields
+
+    @timed("NoteExpression.parse_expression")
+    def parse_expression(self):
+        # the columns can differ in length, the table pads them
+        expressions, equivalents, translations, _, _ = self.fields
+        return expressions, equivalents, translations
 
+    @timed("NoteExpression.parse_examples")
+    def parse_examples(self):
+        _, _, _, examples_dutch, examples_english = self.fields
         return examples_dutch, examples_english
 
 
 class NoteDefault:
-    def __init__(self, word):
-        html = get_mwb_html(word)
-        html_content = html.content.decode("utf-8")
-        start_idx = html_content.find("NL>EN")
-        end_idx = html_content.find("Overige bronnen")
+    def __init__(self, word, page=None):
+        if page is None:
+            page = fetch_mwb_page(word)
 
         self.input_word = word
-        self.html_content = html_content
-        self.doc = lxml.html.fromstring(html_content[start_idx:end_idx])
-
+        self.page = page
+        self.html_content = page.html_content
+        self.doc = page.section("NL>EN", "Overige bronnen")
+        self._headwords = None
+
+    @property
+    def headwords(self):
+        # headwords, part of speech and forms are collected in one pass
+        if self._headwords is None:
+            self._headwords = extractors.extract_headwords(self.doc)
+        return self._headwords
+
+    @timed("parse_dutch_word")
     def parse_dutch_word(self):
-        sections = self.doc.xpath(f'//div/h2[@class="inline"]')
+        sections, _, _ = self.headwords
         # combine multiple entries when one word have different parts of speech
         if len(sections) > 1:
-            dutch = "; ".join(
-                [" ".join(sec.text_content().split()[1:]) for sec in sections]
-            )
+            dutch = "; ".join([" ".join(sec.split()[1:]) for sec in sections])
         else:
-            dutch = sections[0].text_content()
+            dutch = sections[0]
 
         return dutch
 
+    @timed("parse_misc")
     def parse_misc(self):
-        part_of_speech = self.doc.xpath(f'//div/h2[@class="inline"]/parent::*/text()')
+        _, part_of_speech, misc = self.headwords
         part_of_speech = [
             x.strip()
             for x in part_of_speech
@@ -110,106 +439,66 @@ class NoteDefault:
         part_of_speech = "; ".join(part_of_speech)
 
         # pronunciation and plurals (for nouns) / conjugations (for verbs)
-        misc = [
-            x.text_content()
-            for x in self.doc.xpath(
-                f'//div/h2[@class="inline"]/following-sibling::table[1]/tr'
-            )
-        ]
         misc = list({x.replace("\xa0", " ") for x in misc})
         misc.sort()
         misc = join_with_br([part_of_speech] + misc)
 
         return misc
 
+    @timed("parse_explanations")
     def parse_explanations(self):
-        explanations_english = [
-            x.text_content()
-            for x in self.doc.xpath(f'//div/font[@style="color:navy;font-size:10pt"]')
-        ]
-
-        explanations_dutch = [
-            x.text_content()
-            for x in self.doc.xpath(
-                f'//div/font[@style="color:navy;font-size:10pt"]/preceding-sibling::font[1]'
-            )
-            if not x.text_content()[:-1].isdigit()
-        ]
+        explanations_dutch, explanations_english = extractors.extract_explanations(
+            self.doc
+        )
+        explanations_dutch = [x for x in explanations_dutch if not x[:-1].isdigit()]
 
         if (not explanations_english) and (not explanations_dutch):
             raise NoExplanationException(
                 f"No default explanations found on mwb for word [{self.input_word}]"
             )
 
-        # TODO exact match??
-        target_length = max(len(explanations_dutch), len(explanations_english))
-        explanations_dutch = pad_list(explanations_dutch, target_length)
-        explanations_english = pad_list(explanations_english, target_length)
-
         return explanations_dutch, explanations_english
 
+    @timed("parse_explanations_other_sources")
     def parse_explanations_other_sources(self):
-        start_idx = self.html_content.find("Overige bronnen")
-        other_sources = lxml.html.fromstring(self.html_content[start_idx:])
-
-        xpath_english = '//table[@border=0]/tr/td[@style="padding-left:20px"]'
-        explanations_english = [
-            x.text_content() for x in other_sources.xpath(xpath_english)
-        ]
-        explanations_dutch = [
-            x.text_content()
-            for x in other_sources.xpath(f"{xpath_english}/preceding-sibling::*")
-        ]
+        other_sources = self.page.section("Overige bronnen")
+        (
+            explanations_dutch,
+            explanations_english,
+        ) = extractors.extract_other_explanations(other_sources)
 
         if (not explanations_english) and (not explanations_dutch):
             raise NoExplanationException(
                 f"No explanations found in other sources for word [{self.input_word}]"
             )
 
-        # TODO exact match??
-        target_length = max(len(explanations_dutch), len(explanations_english))
-        explanations_english = pad_list(explanations_english, target_length)
-        explanations_dutch = pad_list(explanations_dutch, target_length)
-
         return explanations_dutch, explanations_english
 
+    @timed("parse_examples")
     def parse_examples(self):
-        examples_dutch = [
-            x.text_content()
-            for x in self.doc.xpath(f'//i/font[@style="color:#422526"]')
-        ]
-        examples_english = [
-            x.text_content()
-            for x in self.doc.xpath(f'//i/following-sibling::font[@style="color:navy"]')
-        ]
+        examples_dutch, examples_english = extractors.extract_examples(self.doc)
 
         if (not examples_english) and (not examples_dutch):
             raise NoExampleException(
                 f"No example sentences found for word [{self.input_word}]"
             )
 
-        # TODO exact match??
-        target_length = max(len(examples_english), len(examples_dutch))
-        examples_english = pad_list(examples_english, target_length)
-        examples_dutch = pad_list(examples_dutch, target_length)
-
         return examples_dutch, examples_english
 
+    @timed("parse_examples_other_sources")
     def parse_examples_other_sources(self, num_examples=5):
-        start_idx = self.html_content.find("Voorbeeldzinnen met `")
-        other_examples = lxml.html.fromstring(self.html_content[start_idx:])
+        other_examples = self.page.section("Voorbeeldzinnen met `")
 
-        examples_url = [
-            x.text_content()
-            for x in other_examples.xpath("//script[contains(., load)]")
-            if "zinnendiv" in x.text_content()
-        ][0]
-        examples_url = examples_url.split('load("')[-1].split('");')[0]
+        examples_url = extractors.extract_examples_url(other_examples)
 
-        html_content = requests.get(examples_url).content.decode("utf-8")
-        doc = lxml.html.fromstring(html_content)
+        content = get_prefetcher().take(self.page, examples_url)
+        if content is None:
+            content = fetch_url(examples_url)
+        html_content = content.decode("utf-8")
+        with STATS.timer("lxml.html.fromstring"):
+            doc = lxml.html.fromstring(html_content)
 
-        examples = [x.text_content() for x in doc.xpath("//ol/li")]
+        examples = extractors.text_contents(extractors.OTHER_EXAMPLES(doc))
         examples = [e[5:].split(" EN: ") for e in examples][
             : min(len(examples), num_examples)
         ]
@@ -223,8 +512,9 @@ class NoteDefault:
 
         return examples_dutch, examples_english
 
+    @timed("generate_notes")
     def generate_notes(self):
-        if ERR_STRING in self.doc.text_content():
+        if self.doc.contains_text(ERR_STRING):
             return None
 
         dutch = self.parse_dutch_word()
@@ -233,6 +523,7 @@ class NoteDefault:
         try:
             explanations_dutch, explanations_english = self.parse_explanations()
         except NoExplanationException:
+            STATS.count("fallback explanations -> other sources")
             (
                 explanations_dutch,
                 explanations_english,
@@ -241,51 +532,112 @@ class NoteDefault:
         try:
             examples_dutch, examples_english = self.parse_examples()
         except NoExampleException:
+            STATS.count("fallback examples -> other sources")
             examples_dutch, examples_english = self.parse_examples_other_sources()
 
+        # every field is written into one buffer and joined once. columns of
+        # different lengths are padded while the rows are written
+        explanations = ["<b>explanations</b><br>"]
+        examples = ["<b>examples</b><br>"]
+        write_html_table(
+            explanations, [explanations_dutch, explanations_english], pad=True
+        )
+
         if UITDRUKKING_DEEL in self.html_content:
-            uitdrukking = NoteExpression(self.input_word, self.html_content)
+            uitdrukking = NoteExpression(self.input_word, self.page)
             expressions, equivalents, translations = uitdrukking.parse_expression()
             u_examples_dutch, u_examples_english = uitdrukking.parse_examples()
 
-            explanations = (
-                get_html_table([explanations_dutch, explanations_english])
-                + "<br><b>expressions</b><br>"
-                + get_html_table([expressions, equivalents, translations])
+            explanations.append("<br><b>expressions</b><br>")
+            write_html_table(
+                explanations, [expressions, equivalents, translations], pad=True
             )
-            examples = get_html_table(
-                [
-                    examples_dutch + u_examples_dutch,
-                    examples_english + u_examples_english,
-                ]
+            # both parts are padded on their own before they are joined
+            rows = chain(
+                zip_longest(examples_dutch, examples_english, fillvalue=""),
+                zip_longest(u_examples_dutch, u_examples_english, fillvalue=""),
             )
+            write_html_rows(examples, rows, 2)
         else:
-            explanations = get_html_table([explanations_dutch, explanations_english])
-            examples = get_html_table([examples_dutch, examples_english])
+            write_html_table(examples, [examples_dutch, examples_english], pad=True)
+        explanations.append("<br>")
+        examples.append("<br>")
 
         notefields = {
             "Dutch": dutch,
             "Misc": misc + "<br>",
-            "Explanations": "<b>explanations</b><br>" + explanations + "<br>",
-            "Examples": "<b>examples</b><br>" + examples + "<br>",
+            "Explanations": "".join(explanations),
+            "Examples": "".join(examples),
         }
         return notefields
 
 
-def generate_default_note(word):
-    n = NoteDefault(word)
+_note_flights = SingleFlight(name="note")
+
+
+def generate_default_note(word, page=None):
+    n = NoteDefault(word, page)
     return n.generate_notes()
 
 
-def generate_simple_note(word):
-    html = get_mwb_html(word)
-    doc = lxml.html.fromstring(html.content)
+@timed("generate_simple_note")
+def generate_simple_note(word, page=None):
+    if page is None:
+        page = fetch_mwb_page(word)
+    doc = page.doc
 
     if ERR_STRING in doc.text_content():
         return None
 
-    dutch = doc.xpath("//table[@border=0]/tr[1]/td[1]")[0].text_content()
-    explanations = doc.xpath("//table[@border=0]/tr[1]/td[2]")[0].text_content()
+    dutch = extractors.SIMPLE_DUTCH(doc)[0].text_content()
+    explanations = extractors.SIMPLE_EXPLANATION(doc)[0].text_content()
 
     notefields = {"Dutch": dutch, "Explanations": explanations}
     return notefields
+
+
+def generate_note(word, page=None):
+    # concurrent requests for the same word share one fetch and parse
+    return _note_flights.do(normalize_word(word), lambda: _generate_note(word, page))
+
+
+def _generate_note(word, page=None):
+    if page is None:
+        page = fetch_mwb_page(word)
+
+    try:
+        note_fields = generate_default_note(word, page)
+        STATS.count("note default")
+        return note_fields, True
+    except:
+        STATS.count("fallback default -> simple")
+        return generate_simple_note(word, page), False
+    finally:
+        if page.prefetched:
+            get_prefetcher().release(page)
+
+
+_lexicon = None
+_match_forms = False
+
+
+def configure_lexicon(lexicon=None, match_forms=False):
+    global _lexicon, _match_forms
+    _lexicon = lexicon
+    _match_forms = match_forms
+
+
+def lookup_note(word):
+    if _lexicon is None:
+        return None
+    with STATS.timer("lexicon lookup"):
+        stored = _lexicon.lookup(word, _match_forms, NOTE_VERSION)
+    STATS.count("lexicon hit" if stored is not None else "lexicon miss")
+    return stored
+
+
+def store_note(word, note_fields, is_default_model):
+    # only notes that were actually generated are worth keeping
+    if _lexicon is None or note_fields is None or is_default_model is None:
+        return
+    _lexicon.store(word, note_fields, is_default_model, NOTE_VERSION)
@@ -0,0 +1,104 @@
+import functools
+import json
+import threading
+import time
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, stats, name, fields):
+        self.stats = stats
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.add_timing(self.name, time.perf_counter() - self.start, self.fields)
+        return False
+
+
+class Stats:
+    def __init__(self):
+        self.enabled = False
+        self.timings = {}
+        self.counters = {}
+        self.trace_file = None
+        self.started_at = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def enable(self, trace_path=None):
+        self.enabled = True
+        self.started_at = time.perf_counter()
+        if trace_path is not None:
+            self.trace_file = open(trace_path, "w", encoding="utf-8")
+
+    def timer(self, name, **fields):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, fields)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+            self.trace({"counter": name, "n": n})
+
+    def add_timing(self, name, seconds, fields=None):
+        with self.lock:
+            count, total, longest = self.timings.get(name, (0, 0.0, 0.0))
+            self.timings[name] = (count + 1, total + seconds, max(longest, seconds))
+            self.trace({"stage": name, "seconds": seconds, **(fields or {})})
+
+    def trace(self, event):
+        if self.trace_file is None:
+            return
+        event["time"] = time.perf_counter() - self.started_at
+        event["thread"] = threading.current_thread().name
+        self.trace_file.write(json.dumps(event) + "\n")
+
+    def summary(self):
+        lines = [f"run took {time.perf_counter() - self.started_at:.2f}s"]
+        for name, (count, total, longest) in sorted(self.timings.items()):
+            lines.append(
+                f"    {name:<40} n={count:<7} total {total:9.3f}s"
+                f"  mean {total / count * 1e3:9.3f}ms  max {longest * 1e3:9.3f}ms"
+            )
+        for name, count in sorted(self.counters.items()):
+            lines.append(f"    {name:<40} {count}")
+        return "\n".join(lines)
+
+    def close(self):
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+
+
+STATS = Stats()
+
+
+def timed(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not STATS.enabled:
+                return fn(*args, **kwargs)
+            with STATS.timer(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from anki_async import AsyncAnkiConnect
+from fake_ankiconnect import FakeAnkiConnect
+
+
+NOTE_FIELDS = ["Dutch", "Explanations"]
+CARD_TEMPLATES = [{"Front": "{{Dutch}}", "Back": "{{Explanations}}"}]
+
+
+@pytest.fixture
+def fake():
+    fake = FakeAnkiConnect("127.0.0.1", 0).start()
+    yield fake
+    fake.stop()
+
+
+def run_with_client(fake, coroutine_function):
+    # counts the requests that go out, by action
+    async def run():
+        client = AsyncAnkiConnect(fake.url, linger=0.05)
+        sent = []
+        invoke = client.client.invoke
+
+        def counting_invoke(action, **params):
+            sent.append((action, len(params.get("actions", []))))
+            return invoke(action, **params)
+
+        client.client.invoke = counting_invoke
+        try:
+            result = await coroutine_function(client)
+            await client.drain()
+        finally:
+            client.close()
+        return result, sent
+
+    return asyncio.run(run())
+
+
+def test_calls_are_coalesced_into_multi(fake):
+    fake.collection.invoke("createDeck", deck="tidbits")
+    fake.collection.invoke(
+        "createModel",
+        modelName="dutch_simple",
+        inOrderFields=NOTE_FIELDS,
+        cardTemplates=CARD_TEMPLATES,
+    )
+
+    async def add_notes(client):
+        return await asyncio.gather(
+            *[
+                client.add_note(
+                    {"Dutch": word, "Explanations": ""}, "tidbits", "dutch_simple"
+                )
+                for word in ["fiets", "lopen", "fiets"]
+            ],
+            return_exceptions=True,
+        )
+
+    results, sent = run_with_client(fake, add_notes)
+    assert sent == [("multi", 3)]
+
+    # only the duplicate fails, the other calls get their note ids
+    assert isinstance(results[0], int) and isinstance(results[1], int)
+    assert isinstance(results[2], Exception)
+    assert "duplicate" in str(results[2])
+    assert len(fake.collection.notes) == 2
+
+
+def test_add_note_restores_a_missing_deck(fake):
+    async def add_note(client):
+        await client.ensure_model("dutch_simple", NOTE_FIELDS, CARD_TEMPLATES)
+        return await client.add_note(
+            {"Dutch": "fiets", "Explanations": "bicycle"}, "tidbits", "dutch_simple"
+        )
+
+    note_id, sent = run_with_client(fake, add_note)
+    assert note_id in fake.collection.notes
+    assert "tidbits" in fake.collection.decks
+    # the schema cache looks up the names itself, addNote fails once on the
+    # missing deck and goes again after the deck was created
+    assert [action for action, _ in sent] == [
+        "createModel",
+        "addNote",
+        "createDeck",
+        "addNote",
+    ]
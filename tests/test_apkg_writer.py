@@ -0,0 +1,92 @@
+import json
+import sqlite3
+import zipfile
+
+from apkg_writer import (
+    ApkgWriter,
+    DUPLICATE_ERROR,
+    FIELD_SEPARATOR,
+    SCHEMA_VERSION,
+    field_checksum,
+    stable_id,
+)
+
+
+NOTE_FIELDS = ["Dutch", "Explanations"]
+CARD_TEMPLATES = [
+    {"Front": "{{Dutch}}", "Back": "{{Explanations}}"},
+    {"Front": "{{Explanations}}", "Back": "{{Dutch}}"},
+]
+
+
+def build_package(path, notes):
+    results = []
+    writer = ApkgWriter(path, chunk_size=2, on_result=lambda *r: results.append(r))
+    writer.add_deck("tidbits")
+    writer.add_model("dutch_simple", NOTE_FIELDS, CARD_TEMPLATES)
+    for key, note_fields in notes:
+        writer.add_note(note_fields, "tidbits", "dutch_simple", key=key)
+    writer.close()
+    return results
+
+
+def read_collection(package_path, tmp_path):
+    with zipfile.ZipFile(package_path) as package:
+        assert sorted(package.namelist()) == ["collection.anki2", "media"]
+        assert json.loads(package.read("media")) == {}
+        package.extract("collection.anki2", tmp_path)
+    return sqlite3.connect(str(tmp_path / "collection.anki2"))
+
+
+def test_package_rows(tmp_path):
+    package_path = tmp_path / "words.apkg"
+    results = build_package(
+        str(package_path),
+        [
+            ("fiets", {"Dutch": "<b>fiets</b>", "Explanations": "bicycle"}),
+            ("lopen", {"Dutch": "lopen", "Explanations": ""}),
+            ("fiets again", {"Dutch": "<b>fiets</b>", "Explanations": "bike"}),
+        ],
+    )
+    assert [(key, error) for key, _, error in results] == [
+        ("fiets", None),
+        ("lopen", None),
+        ("fiets again", DUPLICATE_ERROR),
+    ]
+
+    db = read_collection(package_path, tmp_path)
+    model_id = stable_id("dutch_simple")
+    deck_id = stable_id("tidbits")
+
+    notes = db.execute(
+        "select id, mid, flds, sfld, csum, tags from notes order by id"
+    ).fetchall()
+    assert [note[0] for note in notes] == [results[0][1], results[1][1]]
+    assert notes[0][1:] == (
+        model_id,
+        FIELD_SEPARATOR.join(["<b>fiets</b>", "bicycle"]),
+        "fiets",
+        field_checksum("fiets"),
+        " dutch ",
+    )
+    assert notes[1][2] == FIELD_SEPARATOR.join(["lopen", ""])
+
+    # the second template shows the explanation, lopen has none
+    cards = db.execute("select nid, did, ord, due from cards order by id").fetchall()
+    assert cards == [
+        (notes[0][0], deck_id, 0, 1),
+        (notes[0][0], deck_id, 1, 1),
+        (notes[1][0], deck_id, 0, 2),
+    ]
+
+    ver, conf, models, decks = db.execute(
+        "select ver, conf, models, decks from col"
+    ).fetchone()
+    assert ver == SCHEMA_VERSION
+    assert json.loads(conf)["nextPos"] == 3
+    model = json.loads(models)[str(model_id)]
+    assert model["name"] == "dutch_simple"
+    assert [f["name"] for f in model["flds"]] == NOTE_FIELDS
+    assert model["req"] == [[0, "any", [0]], [1, "any", [1]]]
+    assert json.loads(decks)[str(deck_id)]["name"] == "tidbits"
+    db.close()
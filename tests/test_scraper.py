@@ -0,0 +1,46 @@
+import json
+import os
+
+import pytest
+
+import scraper_lxml
+from benchmark import load_words, seed_cache
+from page_cache import PageCache
+from scraper_lxml import generate_default_note, generate_simple_note
+
+
+TESTS_DIR = os.path.dirname(__file__)
+PAGES_DIR = os.path.join(TESTS_DIR, os.pardir, "benchmark_pages")
+
+# the notes the scraper this repo started with generated from benchmark_pages,
+# "error" where it raised for the default model
+with open(os.path.join(TESTS_DIR, "golden_notes.json"), encoding="utf-8") as f:
+    GOLDEN_NOTES = json.load(f)
+
+
+@pytest.fixture(autouse=True)
+def offline_pages(tmp_path):
+    page_cache = PageCache(str(tmp_path / "pages.sqlite"), ttl=None)
+    seed_cache(page_cache, PAGES_DIR)
+    scraper_lxml.configure_cache(page_cache, offline=True)
+    yield
+    scraper_lxml.configure_cache(None)
+    page_cache.close()
+
+
+def test_every_page_has_golden_notes():
+    assert sorted(load_words(PAGES_DIR)) == sorted(GOLDEN_NOTES)
+
+
+@pytest.mark.parametrize("word", sorted(GOLDEN_NOTES))
+def test_default_note(word):
+    try:
+        note_fields = generate_default_note(word)
+    except Exception:
+        note_fields = "error"
+    assert note_fields == GOLDEN_NOTES[word]["default"]
+
+
+@pytest.mark.parametrize("word", sorted(GOLDEN_NOTES))
+def test_simple_note(word):
+    assert generate_simple_note(word) == GOLDEN_NOTES[word]["simple"]
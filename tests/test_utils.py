@@ -0,0 +1,76 @@
+import pytest
+
+from utils import get_html_table, normalize_word, pad_list, write_html_table
+
+
+@pytest.mark.parametrize(
+    "word, expected",
+    [
+        ("fiets", "fiets"),
+        ("  de   fiets ", "fiets"),
+        ("het huis", "huis"),
+        ("fiets (de)", "fiets"),
+        ("de kat uit de boom kijken", "kat uit de boom kijken"),
+        ("het hart op de tong hebben", "hart op de tong hebben"),
+        ("iets (niet) laten (het)", "iets (niet) laten"),
+        ("dekken", "dekken"),
+    ],
+)
+def test_normalize_word(word, expected):
+    assert normalize_word(word) == expected
+
+
+# written by the get_html_table this repo started with
+GOLDEN_TABLES = [
+    (
+        [["ik fiets", "de fiets is rood"], ["I cycle", "the bike is red"]],
+        '<table><tr bgcolor="#FFFFFF"><td width="50%"> ik fiets</td> '
+        '<td width="50%">I cycle </td></tr> <tr bgcolor="#FFF8DC">'
+        '<td width="50%"> de fiets is rood</td> '
+        '<td width="50%">the bike is red </td></tr></table>',
+    ),
+    (
+        [["a", "b", "c"], ["1", "2", "3"], ["x", "y", "z"]],
+        '<table><tr bgcolor="#FFFFFF"><td width="33%"> a</td> '
+        '<td width="33%">1</td> <td width="33%">x </td></tr> '
+        '<tr bgcolor="#FFF8DC"><td width="33%"> b</td> '
+        '<td width="33%">2</td> <td width="33%">y </td></tr> '
+        '<tr bgcolor="#FFFFFF"><td width="33%"> c</td> '
+        '<td width="33%">3</td> <td width="33%">z </td></tr></table>',
+    ),
+    (
+        [["alleen"]],
+        '<table><tr bgcolor="#FFFFFF"><td width="100%"> alleen </td></tr></table>',
+    ),
+    ([[], []], "<table></table>"),
+]
+
+
+@pytest.mark.parametrize("columns, expected", GOLDEN_TABLES)
+def test_get_html_table(columns, expected):
+    assert get_html_table(columns) == expected
+
+
+@pytest.mark.parametrize("columns, expected", GOLDEN_TABLES)
+def test_write_html_table_appends(columns, expected):
+    out = ["before"]
+    assert write_html_table(out, columns) is out
+    assert out[0] == "before"
+    assert "".join(out[1:]) == expected
+
+
+def test_pad_matches_pad_list():
+    expected = (
+        '<table><tr bgcolor="#FFFFFF"><td width="50%"> a</td> '
+        '<td width="50%">1 </td></tr> <tr bgcolor="#FFF8DC">'
+        '<td width="50%"> </td> <td width="50%">2 </td></tr></table>'
+    )
+    assert get_html_table([pad_list(["a"], 2), ["1", "2"]]) == expected
+    assert get_html_table([["a"], ["1", "2"]], pad=True) == expected
+
+
+def test_pad_list_returns_a_new_list():
+    words = ["a"]
+    assert pad_list(words, 3) == ["a", "", ""]
+    assert words == ["a"]
+    assert pad_list(words, 1) == ["a"]
@@ -1,52 +1,255 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+
 from anki_helpers import (
     update_note,
     find_all_notes_in_deck,
     get_note_by_id,
+    get_notes_by_ids,
+    get_word_index,
+    BatchWriter,
+    DEFAULT_BATCH_SIZE,
+)
+from lexicon import Lexicon, DEFAULT_LEXICON_PATH
+from parse_pool import ParsePool, DEFAULT_CHUNK_SIZE
+from journal import Journal, UPDATED, UNCHANGED, FAILED
+from stats import STATS
+from page_cache import PageCache, DEFAULT_CACHE_PATH
+from scraper_lxml import (
+    generate_note,
+    configure_cache,
+    fetch_mwb_page,
+    get_cached_mwb_html,
+    configure_fetch_client,
+    configure_prefetcher,
+    DEFAULT_MAX_WASTED_PREFETCHES,
+    configure_lexicon,
+    store_note,
+    DEFAULT_REQUESTS_PER_SECOND,
+    NOTE_VERSION,
 )
-from scraper_lxml import generate_default_note, generate_simple_note
+from utils import bounded_map, normalize_word
 
 
-def update_existing_note_in_deck(note_id, deck_name, output_file=None):
+DEFAULT_STATE_PATH = os.path.join(
+    os.path.dirname(DEFAULT_CACHE_PATH), "refresh_state.json"
+)
+DEFAULT_JOURNAL_PATH = os.path.join(
+    os.path.dirname(DEFAULT_CACHE_PATH), "update_notes.journal"
+)
 
-    old_note = get_note_by_id(note_id)
+RefreshedNote = namedtuple(
+    "RefreshedNote", ["note_id", "word", "fields", "page_hash", "fields_hash"]
+)
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def fields_hash(note_fields):
+    return content_hash(json.dumps(note_fields, sort_keys=True).encode("utf-8"))
+
+
+class RefreshState:
+    def __init__(self, path=None):
+        self.path = path
+        self.notes = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.notes = json.load(f)
+
+    def get(self, note_id):
+        return self.notes.get(str(note_id))
 
-    word = old_note["fields"]["Dutch"]["value"]
-    word = word.split(";")[0].strip()
-    if word.startswith("de "):
-        word = word.split("de ")[1]
-    elif word.startswith("het "):
-        word = word.split("het ")[1]
-    if word.endswith(")"):
-        word = word.split("(")[0]
+    def set(self, note_id, page_hash, fields_hash):
+        self.notes[str(note_id)] = {
+            "page": page_hash,
+            "fields": fields_hash,
+            "version": NOTE_VERSION,
+        }
 
+    def save(self):
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.notes, f)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def parse_since(since):
     try:
-        new_note = generate_default_note(word)
-        model_name = "dutch_default"
-    except:
-        new_note = generate_simple_note(word)
-        model_name = "dutch_simple"
+        return float(since)
+    except ValueError:
+        return datetime.fromisoformat(since).timestamp()
+
+
+def changed_since(note, since):
+    # note ids are creation times in milliseconds
+    return note["noteId"] / 1000 >= since or note.get("mod", 0) >= since
+
+
+def get_word_from_note(note):
+    word = note["fields"]["Dutch"]["value"]
+    return normalize_word(word.split(";")[0])
+
+
+def write_failed_word(word, output_file=None):
+    if output_file:
+        with open(output_file, "a") as f:
+            f.write("\n")
+            f.write(word)
+
+
+def fetch_note_page(old_note, state=None):
+    # returns the page to parse, or None together with the final outcome
+    note_id = old_note["noteId"]
+    word = get_word_from_note(old_note)
+    previous = state.get(note_id) if state is not None else None
+    if previous is not None and previous.get("version") != NOTE_VERSION:
+        # an unchanged page still gives new fields with a newer version
+        previous = None
 
     try:
+        # the cached page is what the stored note was generated from
+        content = get_cached_mwb_html(word) if previous is not None else None
+        if content is not None and content_hash(content) == previous["page"]:
+            return RefreshedNote(note_id, word, None, previous["page"], None), None
+
+        page = fetch_mwb_page(word)
+    except Exception:
+        return RefreshedNote(note_id, word, None, None, None), None
+    return RefreshedNote(note_id, word, None, content_hash(page.content), None), page
+
+
+def finish_refresh(refreshed, new_note):
+    if new_note is None:
+        return refreshed._replace(page_hash=None)
+    return refreshed._replace(fields=new_note, fields_hash=fields_hash(new_note))
+
+
+def regenerate_note(old_note, state=None):
+    refreshed, page = fetch_note_page(old_note, state)
+    if page is None:
+        return refreshed
+
+    try:
+        new_note, is_default_model = generate_note(refreshed.word, page)
+    except Exception:
+        return finish_refresh(refreshed, None)
+    store_note(refreshed.word, new_note, is_default_model)
+    return finish_refresh(refreshed, new_note)
+
+
+def parse_note_pages(fetched, parse_pool):
+    for refreshed, parsed in parse_pool.map(fetched):
+        if parsed is None:
+            yield refreshed
+            continue
+        store_note(refreshed.word, *parsed)
+        yield finish_refresh(refreshed, parsed[0])
+
+
+def update_existing_note_in_deck(note_id, deck_name, output_file=None):
+
+    old_note = get_note_by_id(note_id)
+    word = get_word_from_note(old_note)
+
+    try:
+        new_note, is_default_model = generate_note(word)
+        model_name = "dutch_default" if is_default_model else "dutch_simple"
         update_note(new_note, deck_name, model_name, note_id)
         print(f"succesfully updated word [{word}]")
     except Exception as e:
         print(f"failed for word [{word}] - {note_id}")
-        if output_file:
-            with open(output_file, "a") as f:
-                f.write("\n")
-                f.write(word)
+        write_failed_word(word, output_file)
 
 
-def update_existing_note_by_word(word, deck_name):
+def update_all_notes_in_deck(
+    deck_name,
+    output_file=None,
+    workers=1,
+    batch_size=DEFAULT_BATCH_SIZE,
+    state=None,
+    since=None,
+    force=False,
+    journal=None,
+    parse_pool=None,
+):
+    if state is None:
+        state = RefreshState()
+
+    def record(note_id, status):
+        if journal is not None:
+            journal.record(note_id, status)
+
+    def report_result(refreshed, result, error):
+        if error is None:
+            state.set(refreshed.note_id, refreshed.page_hash, refreshed.fields_hash)
+            print(f"succesfully updated word [{refreshed.word}]")
+            record(refreshed.note_id, UPDATED)
+        else:
+            print(f"failed for word [{refreshed.word}] - {refreshed.note_id}")
+            write_failed_word(refreshed.word, output_file)
+            record(refreshed.note_id, FAILED)
+
+    # note infos are fetched in large chunks and streamed to the scrapers
+    all_notes_id = find_all_notes_in_deck(deck_name)
+    if journal is not None:
+        all_notes_id = [x for x in all_notes_id if not journal.is_completed(x)]
+    old_notes = get_notes_by_ids(all_notes_id)
+    if since is not None:
+        old_notes = (note for note in old_notes if changed_since(note, since))
+    known_state = None if force else state
+    if parse_pool is None:
+        new_notes = bounded_map(
+            lambda note: regenerate_note(note, known_state), old_notes, max(1, workers)
+        )
+    else:
+        # pages are still fetched by threads, parsing happens in the pool
+        fetched = bounded_map(
+            lambda note: fetch_note_page(note, known_state), old_notes, max(1, workers)
+        )
+        new_notes = parse_note_pages(fetched, parse_pool)
 
     try:
-        new_note = generate_default_note(word)
-        model_name = "dutch_default"
-    except:
-        new_note = generate_simple_note(word)
-        model_name = "dutch_simple"
+        with BatchWriter(batch_size, report_result) as writer:
+            for refreshed in new_notes:
+                previous = None if force else state.get(refreshed.note_id)
+                if refreshed.page_hash is None:
+                    report_result(refreshed, None, "no note generated")
+                elif refreshed.fields is None:
+                    print(f"unchanged page for word [{refreshed.word}]")
+                    record(refreshed.note_id, UNCHANGED)
+                elif previous and previous["fields"] == refreshed.fields_hash:
+                    state.set(
+                        refreshed.note_id, refreshed.page_hash, refreshed.fields_hash
+                    )
+                    print(f"unchanged word [{refreshed.word}]")
+                    record(refreshed.note_id, UNCHANGED)
+                else:
+                    writer.update_note(
+                        refreshed.fields, refreshed.note_id, key=refreshed
+                    )
+    finally:
+        state.save()
+
+
+def update_existing_note_by_word(word, deck_name):
+
+    new_note, is_default_model = generate_note(word)
+    model_name = "dutch_default" if is_default_model else "dutch_simple"
 
     print(new_note)
+    # built on the first call, later words are found in it without a
+    # findNotes, and a missing word gets close ones suggested
+    get_word_index(deck_name)
     return update_note(new_note, deck_name, model_name)
 
 
@@ -57,13 +260,133 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="name of anki deck to update")
     parser.add_argument("-d", "--deck", help="name of deck")
     parser.add_argument("-o", "--output", help="output unfound words to file")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of notes scraped in parallel",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="number of notes sent to anki per request",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=0,
+        help="number of processes parsing pages, 0 parses in this process",
+    )
+    parser.add_argument(
+        "--parse-chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="number of pages sent to a parse process at once",
+    )
+    parser.add_argument(
+        "--cache", default=DEFAULT_CACHE_PATH, help="file to cache scraped pages in"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="always fetch pages from the web"
+    )
+    parser.add_argument(
+        "--offline", action="store_true", help="only use pages from the cache"
+    )
+    parser.add_argument(
+        "--stats", action="store_true", help="print timings and counters at the end"
+    )
+    parser.add_argument("--trace", help="write every timing to a json lines file")
+    parser.add_argument(
+        "--prefetch-budget",
+        type=int,
+        default=DEFAULT_MAX_WASTED_PREFETCHES,
+        help="how many unused example page prefetches to allow, 0 disables them",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=DEFAULT_REQUESTS_PER_SECOND,
+        help="maximum number of requests per second to mijnwoordenboek",
+    )
+    parser.add_argument(
+        "--lexicon",
+        nargs="?",
+        const=DEFAULT_LEXICON_PATH,
+        help="store the regenerated notes in this local lexicon",
+    )
+    parser.add_argument(
+        "--state",
+        default=DEFAULT_STATE_PATH,
+        help="file keeping track of what was written to each note",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="regenerate and write every note, even if nothing changed",
+    )
+    parser.add_argument(
+        "--journal",
+        default=DEFAULT_JOURNAL_PATH,
+        help="file recording the outcome of every note",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip notes that were already handled according to the journal",
+    )
+    parser.add_argument(
+        "--since",
+        type=parse_since,
+        help="only update notes added or modified after this date or unix time",
+    )
     args = parser.parse_args()
+    if args.offline and args.no_cache:
+        parser.error("--offline needs the page cache, drop --no-cache")
+
+    if args.stats or args.trace:
+        STATS.enable(args.trace)
 
     if args.deck is None:
         print("no deck name supplied!")
         sys.exit()
 
-    deck_name = args.deck
-    all_notes_id = find_all_notes_in_deck(deck_name)
-    for note_id in all_notes_id:
-        update_existing_note_in_deck(note_id, deck_name, args.output)
+    if not args.no_cache:
+        configure_cache(PageCache(args.cache), args.offline)
+    configure_fetch_client(requests_per_second=args.rate)
+    # pages parsed in the pool never use what this process prefetched
+    prefetch_budget = 0 if args.parse_workers > 0 else args.prefetch_budget
+    configure_prefetcher(max_wasted=prefetch_budget)
+    if args.lexicon is not None:
+        configure_lexicon(Lexicon(args.lexicon))
+
+    parse_pool = None
+    if args.parse_workers > 0:
+        parse_pool = ParsePool(
+            args.parse_workers,
+            args.parse_chunk_size,
+            None if args.no_cache else args.cache,
+            args.offline,
+            args.rate,
+        )
+    try:
+        with Journal(args.journal, args.resume, args.deck) as note_journal:
+            update_all_notes_in_deck(
+                args.deck,
+                args.output,
+                args.workers,
+                args.batch_size,
+                RefreshState(args.state),
+                args.since,
+                args.force,
+                note_journal,
+                parse_pool,
+            )
+    finally:
+        if parse_pool is not None:
+            parse_pool.close()
+        if args.stats:
+            print(STATS.summary())
+        STATS.close()
@@ -1,3 +1,12 @@
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import zip_longest
+
+from stats import STATS, timed
+
+
 def join_with_br(l):
     return "<br>".join(l)
 
@@ -9,16 +18,42 @@ def _get_table_row_bgcolor(ct):
         return "#FFF8DC"
 
 
-def get_html_table(list_of_columnes):
-    col_width = 100 // len(list_of_columnes)
-    rows = [f'</td> <td width="{col_width}%">'.join(x) for x in zip(*list_of_columnes)]
-    rows = [f'<td width="{col_width}%"> {r} </td>' for r in rows]
-    columns = [
-        f'<tr bgcolor="{_get_table_row_bgcolor(ct)}">{row}</tr>'
-        for ct, row in enumerate(rows)
-    ]
-    columns = " ".join(columns)
-    return f"<table>{columns}</table>"
+@lru_cache(maxsize=None)
+def _get_table_row_parts(num_columns):
+    col_width = 100 // num_columns
+    return (
+        f'"><td width="{col_width}%"> ',
+        f'</td> <td width="{col_width}%">',
+        " </td></tr>",
+    )
+
+
+def write_html_table(out, list_of_columnes, pad=False):
+    # appends the table to out in a single pass over the rows. rows stop at the
+    # shortest column, or with pad, short columns are filled up like pad_list
+    if pad:
+        rows = zip_longest(*list_of_columnes, fillvalue="")
+    else:
+        rows = zip(*list_of_columnes)
+    return write_html_rows(out, rows, len(list_of_columnes))
+
+
+@timed("write_html_table")
+def write_html_rows(out, rows, num_columns):
+    row_start, cell_separator, row_end = _get_table_row_parts(num_columns)
+    out.append("<table>")
+    for ct, row in enumerate(rows):
+        out.append(' <tr bgcolor="' if ct else '<tr bgcolor="')
+        out.append(_get_table_row_bgcolor(ct))
+        out.append(row_start)
+        out.append(cell_separator.join(row))
+        out.append(row_end)
+    out.append("</table>")
+    return out
+
+
+def get_html_table(list_of_columnes, pad=False):
+    return "".join(write_html_table([], list_of_columnes, pad))
 
 
 def pad_list(input_list, target_length):
@@ -31,9 +66,94 @@ def pad_list(input_list, target_length):
     return input_list + [""] * (target_length - input_length)
 
 
+def bounded_map(fn, iterable, workers, buffer_size=None):
+    # like executor.map, but reads the input lazily and keeps results in order
+    if buffer_size is None:
+        buffer_size = 2 * workers
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= buffer_size:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def normalize_word(word):
+    # the one place that turns "de fiets", " fiets " or "fiets (de)" into
+    # the word that is looked up
+    word = " ".join(word.split())
+    if word.startswith("de "):
+        word = word[len("de ") :]
+    elif word.startswith("het "):
+        word = word[len("het ") :]
+    if word.endswith(")"):
+        word = word.rsplit("(", 1)[0]
+    return word.strip()
+
+
+def bounded_edit_distance(a, b, max_distance):
+    # levenshtein distance, or max_distance + 1 as soon as it is known to be larger
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            )
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
+
+
+def deletion_variants(word):
+    return {word[:i] + word[i + 1 :] for i in range(len(word))}
+
+
+class SingleFlight:
+    # calls with the same key that overlap share one call of fn
+    def __init__(self, name=None):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if not leader:
+            if self.name is not None:
+                STATS.count(f"{self.name} shared")
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self.lock:
+                del self.calls[key]
+        return result
+
+
 class NoExplanationException(Exception):
     pass
 
 
 class NoExampleException(Exception):
     pass
+
+
+class PageNotCachedException(Exception):
+    pass